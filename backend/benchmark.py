@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Benchmark the hot paths on a synthetic project.
+
+Generates GoPro-like clips (an ffmpeg testsrc video with a GPMF accel/gyro track
+muxed in, plus LRV, THM and telemetry sidecars), then times each stage with its
+CPU time and peak RSS, and writes the results as JSON.
+
+    python benchmark.py --clips 4 --duration 60 --rate 200 --output results.json
+    python benchmark.py --baseline results.json  # exits 1 if a stage got slower
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import numpy as np
+
+ACCEL_SCALE = 418  # GoPro ACCL units per m/s²
+GYRO_SCALE = 939  # GoPro GYRO units per rad/s
+GPMF_TIMESCALE = 1000
+# Generated files are backdated, so the catalog sees them as settled
+BACKDATE_SECONDS = 60
+
+
+def log(*args):
+    print(*args, file=sys.stderr)
+
+
+# Synthetic telemetry
+
+def synthetic_imu(duration, rate, seed=0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Accel and gyro streams of a camera sitting mostly still, with a burst of motion
+    every 30 seconds, so the interest analysis finds segments.
+
+    Returns:
+        (accel, gyro): (N, 4) timestamp/x/y/z arrays, in m/s² and rad/s.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * rate)) / rate
+    burst = ((t % 30) >= 10) & ((t % 30) < 15)
+
+    accel = np.column_stack((
+        t,
+        0.3 * np.sin(2 * np.pi * 0.5 * t) + rng.normal(0, 0.2, len(t)),
+        0.5 * np.sin(2 * np.pi * 0.2 * t) + 6 * burst + rng.normal(0, 0.2, len(t)),
+        9.81 + rng.normal(0, 0.2, len(t)),
+    ))
+    gyro = np.column_stack((
+        t,
+        0.1 * np.sin(2 * np.pi * 0.3 * t) + 2 * burst * np.sin(2 * np.pi * 2 * t) + rng.normal(0, 0.02, len(t)),
+        rng.normal(0, 0.02, len(t)),
+        rng.normal(0, 0.02, len(t)),
+    ))
+    return accel, gyro
+
+
+def _box(box_type, payload) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def _full_box(box_type, payload, flags=0) -> bytes:
+    return _box(box_type, struct.pack(">I", flags) + payload)
+
+
+def _klv(fourcc, value_type, struct_size, repeat, data) -> bytes:
+    padding = (-len(data)) % 4
+    return struct.pack(">4scBH", fourcc, value_type, struct_size, repeat) + data + b"\0" * padding
+
+
+def gpmf_payloads(accel, gyro, duration) -> list[bytes]:
+    """
+    One GPMF DEVC payload per second of telemetry, as written by GoPro cameras.
+    """
+    payloads = []
+    for second in range(int(np.ceil(duration))):
+        streams = b""
+        for fourcc, name, samples, scale in ((b"ACCL", b"Accelerometer", accel, ACCEL_SCALE),
+                                              (b"GYRO", b"Gyroscope", gyro, GYRO_SCALE)):
+            rows = samples[(samples[:, 0] >= second) & (samples[:, 0] < second + 1), 1:]
+            values = np.clip(np.round(rows * scale), -32768, 32767).astype(">i2")
+            strm = (
+                _klv(b"STNM", b"c", 1, len(name), name)
+                + _klv(b"SCAL", b"s", 2, 1, struct.pack(">h", scale))
+                + _klv(fourcc, b"s", 6, len(values), values.tobytes())
+            )
+            streams += _klv(b"STRM", b"\0", 1, len(strm), strm)
+        devc = _klv(b"DVID", b"L", 4, 1, struct.pack(">I", 1)) + streams
+        payloads.append(_klv(b"DEVC", b"\0", 1, len(devc), devc))
+    return payloads
+
+
+def _gpmf_trak(track_id, payloads, mdat_offset, duration) -> bytes:
+    identity = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    tkhd = _full_box(b"tkhd", struct.pack(">IIIII", 0, 0, track_id, 0, int(duration * GPMF_TIMESCALE))
+                     + b"\0" * 8 + struct.pack(">hhhh", 0, 0, 0, 0) + identity + struct.pack(">II", 0, 0), flags=3)
+    mdhd = _full_box(b"mdhd", struct.pack(">IIIIHH", 0, 0, GPMF_TIMESCALE, int(duration * GPMF_TIMESCALE), 0x55C4, 0))
+    hdlr = _full_box(b"hdlr", struct.pack(">I4s", 0, b"meta") + b"\0" * 12 + b"GoPro MET\0")
+    dinf = _box(b"dinf", _full_box(b"dref", struct.pack(">I", 1) + _full_box(b"url ", b"", flags=1)))
+    stbl = _box(b"stbl", b"".join((
+        _full_box(b"stsd", struct.pack(">I", 1) + _box(b"gpmd", b"\0" * 6 + struct.pack(">H", 1))),
+        _full_box(b"stts", struct.pack(">III", 1, len(payloads), GPMF_TIMESCALE)),
+        _full_box(b"stsc", struct.pack(">IIII", 1, 1, len(payloads), 1)),
+        _full_box(b"stsz", struct.pack(">II", 0, len(payloads)) + b"".join(struct.pack(">I", len(p)) for p in payloads)),
+        _full_box(b"stco", struct.pack(">II", 1, mdat_offset)),
+    )))
+    minf = _box(b"minf", _full_box(b"nmhd", b"") + dinf + stbl)
+    return _box(b"trak", tkhd + _box(b"mdia", mdhd + hdlr + minf))
+
+
+def mux_gpmf(filepath, accel, gyro, duration):
+    """
+    Add a GPMF metadata track to an MP4 written by ffmpeg, in place.
+
+    ffmpeg writes the moov box last, so it is replaced by an mdat holding the GPMF
+    payloads and a new moov with an extra trak, leaving the other tracks' data where it is.
+    """
+    with open(filepath, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        header_start = 0
+        while header_start < file_size:
+            f.seek(header_start)
+            size, box_type = struct.unpack(">I4s", f.read(8))
+            if size == 1:
+                (size,) = struct.unpack(">Q", f.read(8))
+            if box_type == b"moov":
+                break
+            header_start += size
+        if box_type != b"moov" or header_start + size != file_size:
+            raise ValueError(f"{filepath}: expected the moov box last")
+        f.seek(header_start + 8)
+        moov = bytearray(f.read(size - 8))
+
+    # Bump mvhd's next_track_ID past the new track
+    mvhd_start = moov.index(b"mvhd") + 4
+    next_track_offset = mvhd_start + (108 if moov[mvhd_start] == 1 else 96)
+    (track_id,) = struct.unpack_from(">I", moov, next_track_offset)
+    struct.pack_into(">I", moov, next_track_offset, track_id + 1)
+
+    payloads = gpmf_payloads(accel, gyro, duration)
+    mdat = _box(b"mdat", b"".join(payloads))
+    trak = _gpmf_trak(track_id, payloads, header_start + 8, duration)
+    with open(filepath, "r+b") as f:
+        f.seek(header_start)
+        f.write(mdat)
+        f.write(_box(b"moov", bytes(moov) + trak))
+        f.truncate()
+
+
+def ffmpeg(*args):
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *args], check=True)
+
+
+def generate_project(root, name, clips, duration, rate, size, fps) -> str:
+    """
+    Write a synthetic project of `clips` videos with their sidecars under root/projects.
+    """
+    from telemetry import save_stream, sidecar_path
+
+    project_dir = os.path.join(root, "projects", name)
+    os.makedirs(project_dir, exist_ok=True)
+    width, height = size
+    for i in range(clips):
+        uid = f"01{i + 1:04d}"
+        mp4_filepath = os.path.join(project_dir, f"GX{uid}.MP4")
+        ffmpeg(
+            "-f", "lavfi", "-i", f"testsrc=duration={duration}:size={width}x{height}:rate={fps}",
+            "-f", "lavfi", "-i", f"sine=frequency={440 + 10 * i}:duration={duration}",
+            "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest",
+            "-f", "mp4", mp4_filepath,
+        )
+        # Offset each clip's noise, so they aren't identical
+        accel, gyro = synthetic_imu(duration, rate, seed=i)
+        mux_gpmf(mp4_filepath, accel, gyro, duration)
+
+        ffmpeg("-i", mp4_filepath, "-map", "0:v", "-map", "0:a", "-vf", "scale=iw/4:-2",
+               "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "copy", "-f", "mp4",
+               os.path.join(project_dir, f"GL{uid}.LRV"))
+        ffmpeg("-i", mp4_filepath, "-frames:v", "1", "-vf", "scale=160:-2", "-f", "mjpeg",
+               os.path.join(project_dir, f"GX{uid}.THM"))
+        save_stream(sidecar_path(mp4_filepath, "accel"), accel)
+        save_stream(sidecar_path(mp4_filepath, "gyro"), gyro)
+
+    backdated = time.time() - BACKDATE_SECONDS
+    for filename in os.listdir(project_dir):
+        os.utime(os.path.join(project_dir, filename), (backdated, backdated))
+    return project_dir
+
+
+# Measurement
+
+class RssSampler(threading.Thread):
+    """
+    Samples this process's resident set size in the background, keeping the peak.
+    """
+
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = self.rss()
+        self._done = threading.Event()
+
+    @staticmethod
+    def rss() -> int:
+        try:
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            # No procfs (e.g. macOS): fall back to the lifetime peak, in bytes there
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, self.rss())
+
+    def stop(self) -> int:
+        self._done.set()
+        self.join()
+        return max(self.peak, self.rss())
+
+
+def measure(name, fn, results):
+    """
+    Run a stage, and append its wall time, CPU time (own and child processes', e.g.
+    ffmpeg), peak RSS and any detail it returns to results.
+    """
+    log(f"Running {name}")
+    sampler = RssSampler()
+    sampler.start()
+    times = os.times()
+    start = time.perf_counter()
+    detail, error = {}, None
+    try:
+        detail = fn() or {}
+    except Exception as e:
+        traceback.print_exc()
+        error = f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - start
+    peak_rss = sampler.stop()
+    end_times = os.times()
+
+    result = {
+        "name": name,
+        "seconds": round(seconds, 4),
+        "cpu_seconds": round(end_times.user + end_times.system - times.user - times.system, 4),
+        "child_cpu_seconds": round(
+            end_times.children_user + end_times.children_system - times.children_user - times.children_system, 4
+        ),
+        "peak_rss_mb": round(peak_rss / 2 ** 20, 1),
+        "error": error,
+        **detail,
+    }
+    log(f"  {result['seconds']:.3f}s, {result['peak_rss_mb']} MB" + (f", {error}" if error else ""))
+    results.append(result)
+    return result
+
+
+# Stages
+
+def run_stages(project_name, workers) -> list[dict]:
+    from catalog import CATALOG, get_all_projects
+    from models import Segment
+    from orientation import compute_orientation_track, estimate_roll
+    from telemetry import get_telemetry
+
+    results = []
+    state = {}
+
+    def catalog_cold():
+        projects = get_all_projects()
+        state["project"] = next(project for project in projects if project.name == project_name)
+        return {"videos": sum(len(project.videos) for project in projects)}
+
+    def catalog_warm():
+        CATALOG.refresh()
+        return {"videos": sum(len(project.videos) for project in get_all_projects())}
+
+    def videos():
+        return state["project"].videos
+
+    def filepath(video):
+        return os.path.join("./projects", video.project_dir_name, video.mp4_filename)
+
+    def telemetry():
+        samples = 0
+        for video in videos():
+            extracted = get_telemetry(filepath(video))
+            samples += len(extracted.accel) + len(extracted.gyro)
+        return {"samples": samples}
+
+    def suggested_segments():
+        for video in videos():
+            video.calculate_suggested_segments()
+            if not video.segments:
+                # Keep the render stages busy even if nothing stood out
+                video.segments = [Segment(start_time=1, end_time=min(4, video.length))]
+        return {"segments": sum(len(video.segments) for video in videos())}
+
+    def complementary_filter():
+        samples = 0
+        for video in videos():
+            estimate_roll(video.gyro, video.accel)
+            frame_timestamps = np.arange(0, video.length, 1 / 30)
+            compute_orientation_track(video.gyro, video.accel, frame_timestamps)
+            samples += len(video.gyro)
+        return {"samples": samples}
+
+    def stabilize_segment():
+        from process_segments import extract_segment
+        from stabilize import stabilize
+
+        video = videos()[0]
+        segment = video.segments[0]
+        os.makedirs(os.path.join("./projects", video.project_dir_name, "segments"), exist_ok=True)
+        output_path = stabilize(video, segment, extract_segment(video, segment))
+        return {"output_bytes": os.path.getsize(output_path)}
+
+    def final_cut(draft=False):
+        from merge_segments import make_final_cut
+
+        def render():
+            output_path = make_final_cut(state["project"], workers=workers, draft=draft)
+            return {"output_bytes": os.path.getsize(output_path)}
+        return render
+
+    measure("get_all_projects.cold", catalog_cold, results)
+    if "project" not in state:
+        return results
+    measure("get_all_projects.warm", catalog_warm, results)
+    measure("get_telemetry", telemetry, results)
+    measure("calculate_suggested_segments", suggested_segments, results)
+    measure("complementary_filter", complementary_filter, results)
+    measure("stabilize", stabilize_segment, results)
+    measure("make_final_cut.draft", final_cut(draft=True), results)
+    measure("make_final_cut.cold", final_cut(), results)
+    # Every segment is in the render cache now
+    measure("make_final_cut.warm", final_cut(), results)
+    return results
+
+
+def environment() -> dict:
+    try:
+        ffmpeg_version = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.split("\n")[0]
+    except OSError:
+        ffmpeg_version = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "ffmpeg": ffmpeg_version,
+    }
+
+
+def compare(results, baseline, tolerance) -> list[str]:
+    """
+    Stages that took more than (1 + tolerance) times as long as in the baseline.
+    """
+    previous = {stage["name"]: stage for stage in baseline["stages"] if stage.get("error") is None}
+    regressions = []
+    for stage in results["stages"]:
+        before = previous.get(stage["name"])
+        if before is None or stage["error"] is not None or before["seconds"] <= 0:
+            continue
+        ratio = stage["seconds"] / before["seconds"]
+        if ratio > 1 + tolerance:
+            regressions.append(f"{stage['name']}: {before['seconds']:.3f}s -> {stage['seconds']:.3f}s ({ratio:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clips", type=int, default=3, help="number of clips in the project")
+    parser.add_argument("--duration", type=float, default=30, help="length of each clip in seconds")
+    parser.add_argument("--rate", type=float, default=200, help="accel/gyro sample rate in Hz")
+    parser.add_argument("--size", default="640x360", help="video resolution, WxH")
+    parser.add_argument("--fps", type=float, default=30, help="video frame rate")
+    parser.add_argument("--workers", type=int, default=None, help="concurrent ffmpeg processes for the final cut")
+    parser.add_argument("--workdir", default=None, help="where to generate the project (default: a temp dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated project")
+    parser.add_argument("--output", default=None, help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="slowdown allowed before a stage counts as a regression")
+    args = parser.parse_args()
+
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, backend_dir)
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="gopro-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    project_name = "Benchmark"
+
+    # Everything resolves ./projects, metadata_cache.json etc. relative to the working directory
+    os.chdir(workdir)
+    try:
+        setup = []
+        measure("generate", lambda: {"files": len(os.listdir(generate_project(
+            workdir, project_name, args.clips, args.duration, args.rate, (width, height), args.fps
+        )))}, setup)
+        if setup[0]["error"] is not None:
+            sys.exit(setup[0]["error"])
+
+        from merge_segments import FFMPEG_WORKERS
+        stages = run_stages(project_name, args.workers or FFMPEG_WORKERS)
+    finally:
+        os.chdir(backend_dir)
+        if not args.keep and args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "config": {
+            "clips": args.clips,
+            "duration": args.duration,
+            "rate": args.rate,
+            "size": [width, height],
+            "fps": args.fps,
+            "workers": args.workers,
+        },
+        "environment": environment(),
+        "setup": setup,
+        "stages": stages,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "child_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        log(f"Wrote {output}")
+    else:
+        print(json.dumps(results, indent=2))
+
+    if baseline_path:
+        with open(baseline_path, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            log(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from metadata_index import METADATA_INDEX
+from models import Project, Video, get_filenames, get_sidecar_uids, get_uid, index_sidecars
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+PROJECTS_DIR = "./projects"
+POLL_INTERVAL = float(os.environ.get("CATALOG_POLL_INTERVAL", 5))
+# A file modified more recently than this is assumed to still be copying in
+SETTLE_SECONDS = 10
+
+
+class _WakeHandler(FileSystemEventHandler):
+    """
+    Wakes the catalog for changes to projects and the files directly in them. Changes
+    deeper down, like renders under <project>/segments, can't change the catalog.
+    """
+
+    def __init__(self, wake: threading.Event, root):
+        self.wake = wake
+        self.root = os.path.abspath(root)
+
+    def _is_relevant(self, path):
+        if not path:
+            return False
+        relpath = os.path.relpath(os.path.abspath(os.fsdecode(path)), self.root)
+        return not relpath.startswith("..") and len(relpath.split(os.sep)) <= 2
+
+    def on_any_event(self, event):
+        if self._is_relevant(event.src_path) or self._is_relevant(getattr(event, "dest_path", "")):
+            self.wake.set()
+
+
+class ProjectCatalog:
+    """
+    In-memory catalog of projects and videos under ./projects, kept up to date incrementally.
+
+    Only project directories whose mtime changed (files added, removed or renamed)
+    are re-listed, and within them only the videos whose MP4 or sidecars changed
+    are rebuilt. MP4s that are still being written are re-checked on every refresh
+    until they settle.
+    """
+
+    def __init__(self, root=PROJECTS_DIR):
+        self.root = root
+        self._projects: dict[str, Project] = {}
+        self._by_slug: dict[str, Project] = {}
+        self._videos_by_slug: dict[str, dict[str, Video]] = {}
+        self._projects_list: list[Project] = []
+        self._dir_mtimes: dict[str, int] = {}
+        self._filenames: dict[str, set[str]] = {}
+        self._sidecars: dict[str, dict[str, dict[str, str]]] = {}
+        self._unsettled: dict[str, set[str]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self._listeners: list[Callable[[Project, list[Video]], None]] = []
+
+    @property
+    def projects(self) -> list[Project]:
+        if not self._loaded:
+            self.refresh()
+        return self._projects_list
+
+    def get(self, project_slug) -> Optional[Project]:
+        if not self._loaded:
+            self.refresh()
+        return self._by_slug.get(project_slug)
+
+    def get_video(self, project_slug, video_slug) -> Optional[Video]:
+        if not self._loaded:
+            self.refresh()
+        return self._videos_by_slug.get(project_slug, {}).get(video_slug)
+
+    def add_listener(self, callback: Callable[[Project, list[Video]], None]):
+        """
+        Call `callback(project, videos)` with the videos added or rebuilt by each refresh.
+        """
+        self._listeners.append(callback)
+
+    def refresh(self) -> bool:
+        """
+        Bring the catalog up to date with the filesystem.
+
+        Returns:
+            bool: True if any project or video changed.
+        """
+        with self._lock:
+            seen = set()
+            stale = []
+            for entry in os.scandir(self.root):
+                if not entry.is_dir():
+                    continue
+                seen.add(entry.name)
+                mtime = entry.stat().st_mtime_ns
+                if self._dir_mtimes.get(entry.name) != mtime or self._unsettled.get(entry.name):
+                    stale.append((entry.name, mtime))
+
+            removed = set(self._projects) - seen
+            for project_name in removed:
+                print(f"Project removed: {project_name}")
+                self._forget(project_name)
+
+            updates = {project_name: self._diff_project(project_name) for project_name, _ in stale}
+            metadata = METADATA_INDEX.get_many([
+                os.path.join(self.root, project_name, mp4_filename)
+                for project_name, (_, rebuild, _) in updates.items()
+                for mp4_filename in rebuild
+            ])
+
+            changed = bool(removed)
+            rebuilt = []
+            for project_name, mtime in stale:
+                filenames, rebuild, dropped = updates[project_name]
+                changed |= self._apply(project_name, filenames, rebuild, dropped, metadata)
+                self._dir_mtimes[project_name] = mtime
+                if rebuild and project_name in self._projects:
+                    project = self._projects[project_name]
+                    rebuilt.append((project, [video for video in project.videos if video.mp4_filename in rebuild]))
+
+            if changed or not self._loaded:
+                self._projects_list = list(self._projects.values())
+                self._by_slug = {project.slug: project for project in self._projects_list}
+                self._videos_by_slug = {
+                    project.slug: {video.slug: video for video in project.videos}
+                    for project in self._projects_list
+                }
+            self._loaded = True
+
+        for project, videos in rebuilt:
+            for callback in self._listeners:
+                try:
+                    callback(project, videos)
+                except Exception as e:
+                    print(f"Error in project catalog listener: {e}")
+        return changed
+
+    def _forget(self, project_name):
+        self._projects.pop(project_name, None)
+        self._dir_mtimes.pop(project_name, None)
+        self._filenames.pop(project_name, None)
+        self._sidecars.pop(project_name, None)
+        self._unsettled.pop(project_name, None)
+
+    def _diff_project(self, project_name) -> tuple[list[str], set[str], set[str]]:
+        """
+        Work out which videos in a project need rebuilding or dropping.
+
+        Returns:
+            (filenames, mp4s to rebuild, mp4s to drop)
+        """
+        filenames = os.listdir(os.path.join(self.root, project_name))
+        previous = self._filenames.get(project_name, set())
+        current = set(filenames)
+        touched = current ^ previous
+
+        mp4_filenames = set(get_filenames(filenames, ".mp4"))
+        dropped = set(get_filenames(previous, ".mp4")) - mp4_filenames
+        rebuild = set(self._unsettled.get(project_name, set())) & mp4_filenames
+        touched_uids = {uid for filename in touched for uid in get_sidecar_uids(filename)}
+        for mp4_filename in mp4_filenames:
+            if mp4_filename in touched or get_uid(mp4_filename) in touched_uids:
+                rebuild.add(mp4_filename)
+        return filenames, rebuild, dropped
+
+    def _apply(self, project_name, filenames, rebuild, dropped, metadata) -> bool:
+        self._filenames[project_name] = set(filenames)
+        self._sidecars[project_name] = index_sidecars(filenames)
+        if not rebuild and not dropped and project_name in self._projects:
+            return False
+
+        project = self._projects.get(project_name)
+        if project is None:
+            print(f"Project added: {project_name}")
+            project = Project(
+                name=project_name,
+                slug=project_name.replace(" ", "_").lower(),
+                videos=[],
+            )
+            self._projects[project_name] = project
+
+        videos = {video.mp4_filename: video for video in project.videos}
+        for mp4_filename in dropped:
+            videos.pop(mp4_filename, None)
+
+        unsettled = set()
+        now = time.time()
+        for mp4_filename in sorted(rebuild):
+            filepath = os.path.join(self.root, project_name, mp4_filename)
+            try:
+                if now - os.path.getmtime(filepath) < SETTLE_SECONDS:
+                    unsettled.add(mp4_filename)
+            except FileNotFoundError:
+                videos.pop(mp4_filename, None)
+                continue
+            videos[mp4_filename] = Video.from_mp4(project_name, mp4_filename, filenames, metadata=metadata[filepath], sidecars=self._sidecars[project_name])
+        self._unsettled[project_name] = unsettled
+
+        # Swap in a new list so concurrent readers never see a half-updated one
+        project.videos = list(videos.values())
+        print(f"Updated project {project_name}: {len(rebuild)} rebuilt, {len(dropped)} removed")
+        return True
+
+    def watch(self, interval=POLL_INTERVAL):
+        """
+        Keep the catalog up to date in a background thread.
+
+        Uses inotify (via watchdog) to refresh as soon as something changes, and
+        always polls every `interval` seconds as a fallback, e.g. on network mounts.
+        """
+        if self._watcher is not None:
+            return
+
+        if Observer is not None:
+            observer = Observer()
+            observer.schedule(_WakeHandler(self._wake, self.root), self.root, recursive=True)
+            observer.daemon = True
+            observer.start()
+
+        def run():
+            while True:
+                self._wake.wait(interval)
+                # Let a burst of events (e.g. an SD card dump) coalesce into one refresh
+                time.sleep(0.5)
+                self._wake.clear()
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Error refreshing project catalog: {e}")
+
+        self._watcher = threading.Thread(target=run, name="project-catalog", daemon=True)
+        self._watcher.start()
+
+
+CATALOG = ProjectCatalog()
+
+
+def get_all_projects() -> list[Project]:
+    return CATALOG.projects
+
+
+def get_project(project_slug) -> Optional[Project]:
+    return CATALOG.get(project_slug)
+
+
+def get_video(project_slug, video_slug) -> Optional[Video]:
+    return CATALOG.get_video(project_slug, video_slug)
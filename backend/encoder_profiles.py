@@ -0,0 +1,92 @@
+import os
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+EncoderProfileName = Literal["draft", "review", "master"]
+
+
+class EncoderProfile(BaseModel):
+    """
+    How a render is encoded, from quick drafts to the final master. Every re-encode
+    of a render (segments, title card, merge, stabilization) uses the same profile,
+    so its parts can be joined.
+    """
+    name: EncoderProfileName
+    # x264 preset and constant rate factor
+    preset: str
+    crf: int
+    # Encoder threads per ffmpeg process, or None for the caller's default
+    threads: Optional[int] = None
+    # Scale down to at most this height, keeping the aspect ratio
+    max_height: Optional[int] = None
+    audio_bitrate: str = "128k"
+    # Cut from the LRV proxies instead of the full resolution MP4s
+    proxy: bool = False
+
+    def output_options(self, threads=None) -> dict:
+        """
+        ffmpeg output options for the video and audio encoders.
+
+        Args:
+            threads: Encoder threads to use if the profile doesn't set them.
+        """
+        return {**self.video_options(threads), **self.audio_options()}
+
+    def video_options(self, threads=None) -> dict:
+        options = {'vcodec': 'libx264', 'pix_fmt': 'yuv420p', **self.encoder_options()}
+        threads = self.threads or threads
+        if threads is not None:
+            options['threads'] = threads
+        return options
+
+    def encoder_options(self) -> dict:
+        """
+        The options that tune the video encoder without changing its output format, for
+        encodes that must match their source's format, like smart rendered GOPs.
+        """
+        return {'preset': self.preset, 'crf': self.crf}
+
+    def audio_options(self) -> dict:
+        return {'acodec': 'aac', 'b:a': self.audio_bitrate}
+
+    def scale(self, video_stream):
+        """
+        Scale an ffmpeg-python video stream down to the profile's resolution, if it has one.
+        """
+        if self.max_height is None:
+            return video_stream
+        return video_stream.filter('scale', -2, f'min(ih,{self.max_height})')
+
+    def cache_params(self) -> dict:
+        """
+        The settings that change the encoded output, for render cache keys.
+        """
+        return self.model_dump(exclude={"name", "threads"})
+
+
+ENCODER_PROFILES = {
+    profile.name: profile
+    for profile in (
+        # Cut from the proxies and encoded as fast as possible, for checking the edit
+        EncoderProfile(name="draft", preset="ultrafast", crf=28, max_height=480, audio_bitrate="96k", proxy=True),
+        # x264's defaults, at the source resolution
+        EncoderProfile(name="review", preset="medium", crf=23),
+        # Slow and high quality, for the final export
+        EncoderProfile(name="master", preset="slow", crf=18, audio_bitrate="192k"),
+    )
+}
+DEFAULT_ENCODER_PROFILE: EncoderProfileName = os.environ.get("ENCODER_PROFILE", "review")
+
+
+def get_encoder_profile(name: Optional[str] = None) -> EncoderProfile:
+    """
+    An encoder profile by name, or the default profile.
+
+    Raises:
+        ValueError: If there is no profile with that name.
+    """
+    name = name or DEFAULT_ENCODER_PROFILE
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"Unknown encoder profile {name!r}, expected one of {', '.join(ENCODER_PROFILES)}")
+    return ENCODER_PROFILES[name]
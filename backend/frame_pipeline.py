@@ -0,0 +1,253 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import ffmpeg
+import numpy as np
+
+from encoder_profiles import EncoderProfile, get_encoder_profile
+from instrumentation import record_ffmpeg, wait_process
+
+STABILIZE_WORKERS = int(os.environ.get("STABILIZE_WORKERS", os.cpu_count() or 1))
+# Upper bound on decoded frames held in memory at once, across all stages
+MAX_FRAMES_IN_FLIGHT = int(os.environ.get("STABILIZE_MAX_FRAMES_IN_FLIGHT", 64))
+FRAMES_PER_BATCH = 8
+
+
+class FfmpegWriter:
+    """
+    Encodes BGR frames by piping them raw into an ffmpeg process, like cv2.VideoWriter
+    but encoding straight to H.264, and optionally muxing in the audio of another file.
+
+    Parameters:
+        output_path (str): Path to save the video.
+        fps (float): Frame rate of the frames written.
+        size (tuple): (width, height) of the frames written.
+        audio_source (str): If given, copy this file's audio track (if it has one) into the output.
+        profile (EncoderProfile): How to encode and scale the video and audio. Defaults to
+            the default encoder profile.
+        output_options (dict): Extra ffmpeg output options for the video.
+    """
+
+    def __init__(self, output_path, fps, size, audio_source=None, profile: EncoderProfile = None, output_options=None):
+        profile = profile or get_encoder_profile()
+        width, height = size
+        video = ffmpeg.input('pipe:', format='rawvideo', pix_fmt='bgr24', s=f'{width}x{height}', r=fps)
+        streams = [profile.scale(video)]
+        audio_options = {}
+        if audio_source is not None:
+            streams.append(ffmpeg.input(audio_source)['a?'])
+            audio_options = {**profile.audio_options(), 'shortest': None}
+        self.output_path = output_path
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.process = (
+            ffmpeg
+            .output(*streams, output_path, **{**profile.video_options(), **(output_options or {}), **audio_options})
+            .global_args('-hide_banner', '-loglevel', 'error')
+            .run_async(pipe_stdin=True, overwrite_output=True)
+        )
+
+    def write(self, frame):
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+
+    def release(self):
+        if self.process.stdin.closed:
+            return
+        self.process.stdin.close()
+        returncode, cpu_seconds = wait_process(self.process)
+        record_ffmpeg("stabilize", self.output_path, self.started_at, time.perf_counter() - self._start, returncode, cpu_seconds)
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed encoding {self.output_path}")
+
+    def abort(self):
+        """
+        Stop the encoder without finishing the file, e.g. after an error upstream.
+        """
+        if self.process.stdin.closed:
+            return
+        self.process.kill()
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def _warp_worker(shm_name, slot_count, frame_shape, center, border_mode, tasks, results):
+    """
+    Warp worker process. Rotates batches of frames in place in the shared frame buffer.
+
+    Tasks are (batch_index, slots, angles) tuples, and None to stop. Each finished
+    batch is reported as (batch_index, None), or (batch_index, error) if it failed.
+    """
+    # Parallelism comes from the workers, so keep each one to a single OpenCV thread
+    cv2.setNumThreads(1)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        frames = np.ndarray((slot_count, *frame_shape), dtype=np.uint8, buffer=shm.buf)
+        h, w = frame_shape[:2]
+        warped = np.empty(frame_shape, dtype=np.uint8)
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            batch_index, slots, angles = task
+            try:
+                for slot, angle in zip(slots, angles):
+                    M = cv2.getRotationMatrix2D(center, angle, 1.0)
+                    cv2.warpAffine(frames[slot], M, (w, h), dst=warped, flags=cv2.INTER_LINEAR, borderMode=border_mode)
+                    frames[slot] = warped
+                results.put((batch_index, None))
+            except Exception as e:
+                results.put((batch_index, f"{type(e).__name__}: {e}"))
+        del frames
+    finally:
+        shm.close()
+
+
+def warp_video(input_path, output_path, angles, border_mode=cv2.BORDER_REFLECT_101, audio=True,
+               workers=STABILIZE_WORKERS, max_in_flight=MAX_FRAMES_IN_FLIGHT, batch_size=FRAMES_PER_BATCH,
+               profile: EncoderProfile = None):
+    """
+    Rotate every frame of a video about its center, on a pipeline of processes.
+
+    Frames are decoded on a thread into a ring of shared memory slots, rotated in place
+    by a pool of warp worker processes in batches, and piped in order to an ffmpeg
+    encoder by the encode stage, which then recycles the slots. Frames are never
+    pickled, and at most `max_in_flight` frames are held in memory at once.
+
+    Parameters:
+        input_path (str): Path to the input video.
+        output_path (str): Path to save the rotated video.
+        angles (float or sequence of float): Rotation in degrees, for every frame or per
+            frame. With per frame angles, frames past the last angle are dropped.
+        border_mode (int): OpenCV border mode for the corners rotated into view.
+        audio (bool): Copy the input's audio track, if it has one, into the output.
+        workers (int): Number of warp worker processes.
+        max_in_flight (int): Maximum number of decoded frames in memory.
+        batch_size (int): Frames per task sent to a warp worker.
+        profile (EncoderProfile): How to encode the output. Defaults to the default encoder profile.
+
+    Returns:
+        int: Number of frames written.
+    """
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open {input_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    w, h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    frame_shape = (h, w, 3)
+    frame_limit = None if np.isscalar(angles) else len(angles)
+
+    slot_count = max(max_in_flight, batch_size)
+    shm = shared_memory.SharedMemory(create=True, size=slot_count * h * w * 3)
+    frames = np.ndarray((slot_count, *frame_shape), dtype=np.uint8, buffer=shm.buf)
+    free_slots = queue.Queue()
+    for slot in range(slot_count):
+        free_slots.put(slot)
+
+    context = multiprocessing.get_context("spawn")
+    tasks = context.Queue()
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=_warp_worker,
+            args=(shm.name, slot_count, frame_shape, (w / 2, h / 2), border_mode, tasks, results),
+            name=f"warp-{i}",
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    batches = {}
+    stop = threading.Event()
+
+    def decode():
+        batch_index = 0
+        frame_id = 0
+        eof = False
+        try:
+            while not eof and not stop.is_set():
+                slots = []
+                while len(slots) < batch_size and not stop.is_set():
+                    if frame_limit is not None and frame_id >= frame_limit:
+                        eof = True
+                        break
+                    slot = free_slots.get()
+                    ret, frame = cap.read()
+                    if not ret:
+                        free_slots.put(slot)
+                        eof = True
+                        break
+                    frames[slot] = frame
+                    slots.append(slot)
+                    frame_id += 1
+                if not slots:
+                    break
+                batch_angles = [
+                    float(angles if frame_limit is None else angles[i])
+                    for i in range(frame_id - len(slots), frame_id)
+                ]
+                batches[batch_index] = slots
+                tasks.put((batch_index, slots, batch_angles))
+                batch_index += 1
+            results.put(("decoded", batch_index))
+        except Exception as e:
+            results.put(("decoded", f"{type(e).__name__}: {e}"))
+
+    decoder = threading.Thread(target=decode, name="decode", daemon=True)
+    out = FfmpegWriter(output_path, fps, (w, h), audio_source=input_path if audio else None, profile=profile)
+    written = 0
+    try:
+        decoder.start()
+        total_batches = None
+        finished = set()
+        next_batch = 0
+        while total_batches is None or next_batch < total_batches:
+            try:
+                batch_index, error = results.get(timeout=1)
+            except queue.Empty:
+                if not all(process.is_alive() for process in processes):
+                    raise RuntimeError(f"A warp worker died while stabilizing {input_path}")
+                continue
+            if batch_index == "decoded":
+                if isinstance(error, str):
+                    raise RuntimeError(f"Decoding {input_path} failed: {error}")
+                total_batches = error
+            elif error is not None:
+                raise RuntimeError(f"Warping {input_path} failed: {error}")
+            else:
+                finished.add(batch_index)
+
+            # Encode stage: write finished batches in order and recycle their slots
+            while next_batch in finished:
+                finished.remove(next_batch)
+                for slot in batches.pop(next_batch):
+                    out.write(frames[slot])
+                    free_slots.put(slot)
+                    written += 1
+                next_batch += 1
+        out.release()
+    finally:
+        stop.set()
+        for _ in processes:
+            tasks.put(None)
+        # Unblock the decoder if it is waiting on a slot
+        for slot in range(slot_count):
+            free_slots.put(slot)
+        decoder.join()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        cap.release()
+        out.abort()
+        del frames
+        shm.close()
+        shm.unlink()
+
+    return written
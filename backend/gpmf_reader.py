@@ -0,0 +1,291 @@
+import struct
+from typing import Iterator, Optional
+
+import numpy as np
+
+# GPMF value type -> numpy dtype. All GPMF values are big-endian.
+GPMF_TYPES = {
+    b"b": np.dtype("i1"),
+    b"B": np.dtype("u1"),
+    b"s": np.dtype(">i2"),
+    b"S": np.dtype(">u2"),
+    b"l": np.dtype(">i4"),
+    b"L": np.dtype(">u4"),
+    b"j": np.dtype(">i8"),
+    b"J": np.dtype(">u8"),
+    b"f": np.dtype(">f4"),
+    b"d": np.dtype(">f8"),
+    b"q": np.dtype(">i4"),
+    b"Q": np.dtype(">i8"),
+}
+# Fixed point types, as divisors
+FIXED_POINT = {b"q": 2.0 ** 16, b"Q": 2.0 ** 32}
+
+PAYLOADS_PER_CHUNK = 60
+
+
+class MetadataTrack:
+    """
+    Location of every GPMF payload in an MP4, from the metadata track's sample table.
+
+    Attributes:
+        offsets: (N,) file offset of each payload.
+        sizes: (N,) size of each payload in bytes.
+        start_times: (N,) start of each payload, in seconds.
+        durations: (N,) duration of each payload, in seconds.
+    """
+
+    def __init__(self, offsets, sizes, start_times, durations):
+        self.offsets = offsets
+        self.sizes = sizes
+        self.start_times = start_times
+        self.durations = durations
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+def iter_boxes(data, start=0, end=None) -> Iterator[tuple[bytes, int, int]]:
+    """
+    Yield (type, payload start, payload end) for each MP4 box in data[start:end].
+    """
+    end = len(data) if end is None else end
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, position)
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", data, position + 8)
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header:
+            break
+        yield box_type, position + header, min(position + size, end)
+        position += size
+
+
+def read_moov(f) -> bytes:
+    """
+    Read the moov box of an MP4, seeking past everything else (mdat in particular).
+    """
+    f.seek(0, 2)
+    file_size = f.tell()
+    position = 0
+    while position + 8 <= file_size:
+        f.seek(position)
+        header = f.read(16)
+        size, box_type = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", header, 8)
+            header_size = 16
+        elif size == 0:
+            size = file_size - position
+        if size < header_size:
+            break
+        if box_type == b"moov":
+            f.seek(position + header_size)
+            return f.read(size - header_size)
+        position += size
+    raise ValueError("No moov box found")
+
+
+def find_boxes(data, start, end, path) -> Iterator[tuple[int, int]]:
+    """
+    Yield (payload start, payload end) of every box matching path, e.g. [b"trak", b"mdia"].
+    """
+    for box_type, box_start, box_end in iter_boxes(data, start, end):
+        if box_type != path[0]:
+            continue
+        if len(path) == 1:
+            yield box_start, box_end
+        else:
+            yield from find_boxes(data, box_start, box_end, path[1:])
+
+
+def find_box(data, start, end, path) -> Optional[tuple[int, int]]:
+    return next(find_boxes(data, start, end, path), None)
+
+
+def full_box_table(data, box, dtype, columns=1, header=8) -> np.ndarray:
+    """
+    The entries of a sample table box: version/flags and entry count, then `columns` values per entry.
+    """
+    start, _ = box
+    (count,) = struct.unpack_from(">I", data, start + header - 4)
+    table = np.frombuffer(data, dtype=dtype, count=count * columns, offset=start + header)
+    return table.reshape(count, columns) if columns > 1 else table
+
+
+def parse_metadata_track(data, trak) -> Optional[MetadataTrack]:
+    """
+    Build the payload table of a trak box, if it is a GPMF (gpmd) metadata track.
+    """
+    trak_start, trak_end = trak
+    stsd = find_box(data, trak_start, trak_end, [b"mdia", b"minf", b"stbl", b"stsd"])
+    # stsd: version/flags, entry count, then sample entries of (size, format, ...)
+    if stsd is None or data[stsd[0] + 12:stsd[0] + 16] != b"gpmd":
+        return None
+
+    mdhd_start, _ = find_box(data, trak_start, trak_end, [b"mdia", b"mdhd"])
+    version = data[mdhd_start]
+    timescale_offset = mdhd_start + (20 if version == 1 else 12)
+    (timescale,) = struct.unpack_from(">I", data, timescale_offset)
+
+    stbl_start, stbl_end = find_box(data, trak_start, trak_end, [b"mdia", b"minf", b"stbl"])
+    boxes = {box_type: (start, end) for box_type, start, end in iter_boxes(data, stbl_start, stbl_end)}
+
+    # stsz: version/flags, uniform sample size, count, then per-sample sizes if not uniform
+    stsz_start, _ = boxes[b"stsz"]
+    sample_size, sample_count = struct.unpack_from(">II", data, stsz_start + 4)
+    if sample_size:
+        sizes = np.full(sample_count, sample_size, dtype=np.int64)
+    else:
+        sizes = full_box_table(data, boxes[b"stsz"], ">u4", header=12).astype(np.int64)
+
+    if b"co64" in boxes:
+        chunk_offsets = full_box_table(data, boxes[b"co64"], ">u8").astype(np.int64)
+    else:
+        chunk_offsets = full_box_table(data, boxes[b"stco"], ">u4").astype(np.int64)
+
+    # stsc runs of (first chunk, samples per chunk, description index) -> samples in every chunk
+    stsc = full_box_table(data, boxes[b"stsc"], ">u4", columns=3).astype(np.int64)
+    run_lengths = np.diff(np.append(stsc[:, 0], len(chunk_offsets) + 1))
+    samples_per_chunk = np.repeat(stsc[:, 1], run_lengths)
+
+    # Each sample sits after the samples before it in its chunk
+    chunk_of_sample = np.repeat(np.arange(len(chunk_offsets)), samples_per_chunk)[:sample_count]
+    first_sample_of_chunk = np.concatenate(([0], np.cumsum(samples_per_chunk)[:-1]))[chunk_of_sample]
+    starts = np.cumsum(sizes) - sizes
+    offsets = chunk_offsets[chunk_of_sample] + starts - starts[first_sample_of_chunk]
+
+    stts = full_box_table(data, boxes[b"stts"], ">u4", columns=2).astype(np.int64)
+    deltas = np.repeat(stts[:, 1], stts[:, 0])[:sample_count]
+    start_times = np.concatenate(([0], np.cumsum(deltas)[:-1])) / timescale
+
+    return MetadataTrack(offsets, sizes, start_times, deltas / timescale)
+
+
+def find_metadata_track(f) -> MetadataTrack:
+    """
+    Locate the GPMF track of an open MP4 file from its sample table. Only the moov box is read.
+    """
+    moov = read_moov(f)
+    for trak in find_boxes(moov, 0, len(moov), [b"trak"]):
+        track = parse_metadata_track(moov, trak)
+        if track is not None:
+            return track
+    raise ValueError("No GPMF metadata track found")
+
+
+def iter_klv(payload, start=0, end=None) -> Iterator[tuple[bytes, bytes, int, int, int]]:
+    """
+    Yield (fourcc, type, struct size, repeat, data offset) for each GPMF KLV entry in payload[start:end].
+    """
+    end = len(payload) if end is None else end
+    position = start
+    while position + 8 <= end:
+        fourcc, value_type, struct_size, repeat = struct.unpack_from(">4scBH", payload, position)
+        if fourcc == b"\0\0\0\0":
+            break
+        yield fourcc, value_type, struct_size, repeat, position + 8
+        # Values are padded to 32 bits
+        position += 8 + ((struct_size * repeat + 3) & ~3)
+
+
+def read_values(payload, value_type, struct_size, repeat, offset) -> Optional[np.ndarray]:
+    """
+    Decode a KLV entry's values as a (repeat, channels) float64 array, or None for unsupported types.
+    """
+    dtype = GPMF_TYPES.get(value_type)
+    if dtype is None or struct_size % dtype.itemsize:
+        return None
+    channels = struct_size // dtype.itemsize
+    values = np.frombuffer(payload, dtype=dtype, count=repeat * channels, offset=offset)
+    values = values.astype(np.float64).reshape(repeat, channels)
+    if value_type in FIXED_POINT:
+        values /= FIXED_POINT[value_type]
+    return values
+
+
+def parse_payload(payload, fourcc) -> Optional[np.ndarray]:
+    """
+    Extract a sensor stream's scaled samples from one GPMF payload.
+
+    Parameters:
+        payload (bytes): One sample of the GPMF track.
+        fourcc (bytes): Stream to extract, e.g. b"ACCL", b"GYRO" or b"GPS5".
+
+    Returns:
+        np.ndarray: (N, channels) samples divided by the stream's SCAL, or None if
+            the payload has no such stream.
+    """
+    for devc_fourcc, value_type, struct_size, repeat, devc_start in iter_klv(payload):
+        if devc_fourcc != b"DEVC" or value_type != b"\0":
+            continue
+        devc_end = devc_start + struct_size * repeat
+        for strm_fourcc, value_type, struct_size, repeat, strm_start in iter_klv(payload, devc_start, devc_end):
+            if strm_fourcc != b"STRM" or value_type != b"\0":
+                continue
+            scale = None
+            # SCAL always precedes the data it applies to within a STRM
+            for key, value_type, struct_size, repeat, offset in iter_klv(payload, strm_start, strm_start + struct_size * repeat):
+                if key == b"SCAL":
+                    scale = read_values(payload, value_type, struct_size, repeat, offset)
+                elif key == fourcc:
+                    values = read_values(payload, value_type, struct_size, repeat, offset)
+                    if values is None:
+                        return None
+                    if scale is not None:
+                        # One divisor for every channel, or one per channel
+                        scale = scale.reshape(-1)
+                        values /= scale if len(scale) == values.shape[1] else scale[0]
+                    return values
+    return None
+
+
+def iter_stream(filepath, fourcc, payloads_per_chunk=PAYLOADS_PER_CHUNK) -> Iterator[np.ndarray]:
+    """
+    Stream a GPMF sensor track out of a GoPro MP4 in chunks.
+
+    The GPMF payloads are located through the MP4 sample table and read with seeks,
+    so only the moov box and the telemetry itself are ever read, never the video.
+    Samples within a payload are spread evenly over the payload's duration.
+
+    Parameters:
+        filepath (str): Path to the MP4 (or LRV) file.
+        fourcc (str): Stream to extract, e.g. "ACCL", "GYRO" or "GPS5".
+        payloads_per_chunk (int): Payloads (about one second each) per yielded chunk.
+
+    Yields:
+        np.ndarray: (N, 1 + channels) float64 rows of timestamp followed by the scaled values.
+    """
+    fourcc = fourcc.encode() if isinstance(fourcc, str) else fourcc
+    with open(filepath, "rb") as f:
+        track = find_metadata_track(f)
+        chunk = []
+        for i in range(len(track)):
+            f.seek(int(track.offsets[i]))
+            values = parse_payload(f.read(int(track.sizes[i])), fourcc)
+            if values is not None and len(values):
+                timestamps = track.start_times[i] + track.durations[i] * np.arange(len(values)) / len(values)
+                chunk.append(np.column_stack((timestamps, values)))
+            if len(chunk) >= payloads_per_chunk:
+                yield np.concatenate(chunk)
+                chunk = []
+        if chunk:
+            yield np.concatenate(chunk)
+
+
+def read_stream(filepath, fourcc, channels=3) -> np.ndarray:
+    """
+    Read a whole GPMF sensor track with iter_stream.
+
+    Returns:
+        np.ndarray: (N, 1 + channels) float64 rows of timestamp followed by the scaled values.
+    """
+    chunks = list(iter_stream(filepath, fourcc))
+    if not chunks:
+        return np.empty((0, 1 + channels), dtype=np.float64)
+    return np.concatenate(chunks)
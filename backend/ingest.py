@@ -0,0 +1,224 @@
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+from catalog import CATALOG, SETTLE_SECONDS
+from instrumentation import METRICS, TimingReport, span
+from models import Project, Video
+
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", max(1, (os.cpu_count() or 1) // 2)))
+
+AnalysisStatus = Literal["queued", "running", "done", "failed"]
+
+
+class VideoAnalysis(BaseModel):
+    project_slug: str
+    video_slug: str
+    mp4_filename: str
+    status: AnalysisStatus = "queued"
+    queued_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    suggested_segments: Optional[int] = None
+    has_thumbnail: bool = False
+    has_proxy: bool = False
+    error: Optional[str] = None
+
+
+def _analyse(filepath) -> tuple[Optional[int], TimingReport]:
+    """
+    Worker process entry point. Extracts a video's telemetry, caches its interest
+    pyramid, and saves its suggested segments if it has no segments yet.
+
+    Returns:
+        (segments, timings): Number of suggested segments written, or None if the video
+            already had segments, and the timings of the analysis.
+    """
+    METRICS.reset()
+    return _suggest_segments(filepath), METRICS.snapshot()
+
+
+def _suggest_segments(filepath) -> Optional[int]:
+    from interest import (
+        SUGGESTED_SEGMENT_THRESHOLD,
+        compute_interest,
+        extract_interesting_segments,
+        load_interest_pyramid,
+    )
+    from segment_store import write_json_atomic
+    from telemetry import load_telemetry, sidecar_path
+
+    telemetry = load_telemetry(filepath)
+    segments_filepath = sidecar_path(filepath, "segments", ".json")
+    if os.path.exists(segments_filepath):
+        # Computes the interest only if the cached pyramid is missing or stale
+        load_interest_pyramid(filepath)
+        return None
+
+    with span("interest", os.path.basename(filepath)):
+        timestamps, interest = compute_interest(telemetry.accel, telemetry.gyro)
+        segments = [
+            {"start_time": start, "end_time": end}
+            for start, end in extract_interesting_segments(timestamps, interest, SUGGESTED_SEGMENT_THRESHOLD)
+        ]
+    load_interest_pyramid(filepath, interest=(timestamps, interest))
+    # Never clobber segments saved in the meantime, e.g. by an edit
+    if not write_json_atomic(segments_filepath, {"segments": segments}, overwrite=False):
+        return None
+    return len(segments)
+
+
+def is_analysed(video: Video) -> bool:
+    """
+    Whether a video's telemetry, interest pyramid and segments are all on disk already.
+    """
+    from interest import interest_pyramid_path
+    from telemetry import sidecar_path
+
+    filepath = os.path.join("./projects", video.project_dir_name, video.mp4_filename)
+    try:
+        gyro_mtime = os.path.getmtime(sidecar_path(filepath, "gyro"))
+        return (
+            os.path.getmtime(interest_pyramid_path(filepath)) >= gyro_mtime
+            and os.path.exists(sidecar_path(filepath, "segments", ".json"))
+        )
+    except FileNotFoundError:
+        return False
+
+
+class IngestQueue:
+    """
+    Analyses newly discovered videos in a pool of worker processes, so opening a
+    video never waits on telemetry extraction.
+
+    Videos are picked up from the project catalog as they appear, and analysed
+    most recently modified first. Videos that are already analysed are marked done
+    without running anything.
+    """
+
+    def __init__(self, max_workers=INGEST_WORKERS):
+        self.max_workers = max_workers
+        self._analyses: dict[tuple[str, str], VideoAnalysis] = {}
+        self._mtimes: dict[tuple[str, str], float] = {}
+        self._heap: list[tuple[float, int, tuple[str, str], str]] = []
+        self._counter = itertools.count()
+        self._slots = threading.Semaphore(max_workers)
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        if self._executor is not None:
+            return
+        self._executor = self._new_executor()
+        threading.Thread(target=self._dispatch, name="ingest-dispatch", daemon=True).start()
+        CATALOG.add_listener(self.enqueue)
+        for project in CATALOG.projects:
+            self.enqueue(project, project.videos)
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def enqueue(self, project: Project, videos: list[Video]):
+        """
+        Queue videos for analysis, unless they were already queued at their current mtime.
+        """
+        now = time.time()
+        with self._lock:
+            for video in videos:
+                key = (project.slug, video.slug)
+                filepath = os.path.join("./projects", video.project_dir_name, video.mp4_filename)
+                try:
+                    mtime = os.path.getmtime(filepath)
+                except FileNotFoundError:
+                    continue
+                # Still copying in. The catalog rebuilds it again once it settles.
+                if now - mtime < SETTLE_SECONDS or self._mtimes.get(key) == mtime:
+                    continue
+                self._mtimes[key] = mtime
+                analysis = VideoAnalysis(
+                    project_slug=project.slug,
+                    video_slug=video.slug,
+                    mp4_filename=video.mp4_filename,
+                    queued_at=now,
+                    has_thumbnail=video.thumbnail_filename is not None,
+                    has_proxy=video.lrv_filename is not None,
+                )
+                self._analyses[key] = analysis
+                if is_analysed(video):
+                    analysis.status = "done"
+                    analysis.finished_at = now
+                    continue
+                heapq.heappush(self._heap, (-mtime, next(self._counter), key, filepath))
+            self._wake.notify()
+
+    def prioritise(self, project: Project, video: Video):
+        """
+        Move a video to the front of the queue, e.g. because someone opened it. Videos that
+        aren't queued yet, or whose analysis failed, are queued first.
+        """
+        key = (project.slug, video.slug)
+        with self._lock:
+            analysis = self._analyses.get(key)
+            requeue = analysis is None or analysis.status == "failed"
+            if requeue:
+                self._mtimes.pop(key, None)
+        if requeue:
+            self.enqueue(project, [video])
+
+        with self._lock:
+            for i, (_, _, queued_key, filepath) in enumerate(self._heap):
+                if queued_key == key:
+                    self._heap[i] = (float("-inf"), next(self._counter), key, filepath)
+                    heapq.heapify(self._heap)
+                    self._wake.notify()
+                    return
+
+    def get(self, project_slug, video_slug) -> Optional[VideoAnalysis]:
+        return self._analyses.get((project_slug, video_slug))
+
+    def list(self, project_slug) -> list[VideoAnalysis]:
+        return [analysis for (slug, _), analysis in self._analyses.items() if slug == project_slug]
+
+    def _dispatch(self):
+        while True:
+            self._slots.acquire()
+            with self._lock:
+                while not self._heap:
+                    self._wake.wait()
+                _, _, key, filepath = heapq.heappop(self._heap)
+                analysis = self._analyses[key]
+                analysis.status = "running"
+                analysis.started_at = time.time()
+            print(f"Analysing {filepath}")
+            try:
+                future = self._executor.submit(_analyse, filepath)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed by the OOM killer), which breaks the whole pool
+                self._executor = self._new_executor()
+                future = self._executor.submit(_analyse, filepath)
+            future.add_done_callback(lambda future, analysis=analysis: self._finish(analysis, future))
+
+    def _finish(self, analysis: VideoAnalysis, future):
+        with self._lock:
+            analysis.finished_at = time.time()
+            try:
+                analysis.suggested_segments, timings = future.result()
+                analysis.status = "done"
+                METRICS.merge(timings)
+            except Exception as e:
+                analysis.status = "failed"
+                analysis.error = f"{type(e).__name__}: {e}"
+                print(f"Analysis of {analysis.mp4_filename} failed: {analysis.error}")
+        self._slots.release()
+
+
+INGEST_QUEUE = IngestQueue()
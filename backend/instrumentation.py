@@ -0,0 +1,191 @@
+import contextlib
+import cProfile
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Optional
+
+import ffmpeg
+from pydantic import BaseModel
+
+try:
+    import sentry_sdk
+except ImportError:
+    sentry_sdk = None
+
+# If set, Python stages opened with span(..., profile=True) dump cProfile stats here
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+# ffmpeg runs kept for the metrics endpoint and job reports, most recent last
+MAX_FFMPEG_RUNS = 500
+
+
+class StageTiming(BaseModel):
+    count: int = 0
+    seconds: float = 0
+    cpu_seconds: float = 0
+    max_seconds: float = 0
+
+
+class FfmpegRun(BaseModel):
+    label: str
+    output_path: Optional[str] = None
+    started_at: float
+    seconds: float
+    cpu_seconds: Optional[float] = None
+    output_bytes: Optional[int] = None
+    returncode: int
+
+
+class TimingReport(BaseModel):
+    """
+    Where the time went: totals per stage, and every ffmpeg process run.
+
+    Stage CPU time is the Python thread's own. ffmpeg CPU time is the process's
+    user + system time.
+    """
+    stages: dict[str, StageTiming] = {}
+    ffmpeg_runs: list[FfmpegRun] = []
+
+
+class Metrics:
+    """
+    Process-wide registry of stage timings and ffmpeg runs.
+    """
+
+    def __init__(self):
+        self._report = TimingReport()
+        self._lock = threading.Lock()
+
+    def record_stage(self, name, seconds, cpu_seconds):
+        with self._lock:
+            stage = self._report.stages.setdefault(name, StageTiming())
+            stage.count += 1
+            stage.seconds += seconds
+            stage.cpu_seconds += cpu_seconds
+            stage.max_seconds = max(stage.max_seconds, seconds)
+
+    def record_ffmpeg(self, run: FfmpegRun):
+        with self._lock:
+            self._report.ffmpeg_runs.append(run)
+            del self._report.ffmpeg_runs[:-MAX_FFMPEG_RUNS]
+
+    def merge(self, report: TimingReport):
+        """
+        Add a report from another process, e.g. a render job's.
+        """
+        with self._lock:
+            for name, timing in report.stages.items():
+                stage = self._report.stages.setdefault(name, StageTiming())
+                stage.count += timing.count
+                stage.seconds += timing.seconds
+                stage.cpu_seconds += timing.cpu_seconds
+                stage.max_seconds = max(stage.max_seconds, timing.max_seconds)
+            self._report.ffmpeg_runs.extend(report.ffmpeg_runs)
+            del self._report.ffmpeg_runs[:-MAX_FFMPEG_RUNS]
+
+    def snapshot(self) -> TimingReport:
+        with self._lock:
+            return self._report.model_copy(deep=True)
+
+    def reset(self):
+        with self._lock:
+            self._report = TimingReport()
+
+
+METRICS = Metrics()
+
+
+@contextlib.contextmanager
+def span(op, description=None, profile=False):
+    """
+    Time a stage of work into METRICS, as a Sentry span if there is a transaction.
+
+    Parameters:
+        op (str): Stage name, e.g. "probe", "fade" or "stabilize".
+        description (str): What the span works on, e.g. a file name.
+        profile (bool): Dump cProfile stats for the stage to PROFILE_DIR, if it is set.
+    """
+    sentry_span = (
+        sentry_sdk.start_span(op=op, name=description)
+        if sentry_sdk is not None else contextlib.nullcontext()
+    )
+    profiler = cProfile.Profile() if profile and PROFILE_DIR else None
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    with sentry_span:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                profiler.dump_stats(os.path.join(PROFILE_DIR, f"{op}-{os.getpid()}-{time.time_ns()}.prof"))
+            METRICS.record_stage(op, time.perf_counter() - start, time.thread_time() - cpu_start)
+
+
+def wait_process(process: subprocess.Popen) -> tuple[int, Optional[float]]:
+    """
+    Wait for a process and return its exit code and its CPU time (user + system).
+
+    The process is reaped with wait4, which reports its own resource usage. That
+    is exact even with other processes running concurrently, unlike RUSAGE_CHILDREN.
+    """
+    if not hasattr(os, "wait4"):
+        return process.wait(), None
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Already reaped
+        return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage.ru_utime + usage.ru_stime
+
+
+def record_ffmpeg(label, output_path, started_at, seconds, returncode, cpu_seconds):
+    try:
+        output_bytes = os.path.getsize(output_path) if output_path else None
+    except OSError:
+        output_bytes = None
+    METRICS.record_ffmpeg(FfmpegRun(
+        label=label,
+        output_path=output_path,
+        started_at=started_at,
+        seconds=seconds,
+        cpu_seconds=cpu_seconds,
+        output_bytes=output_bytes,
+        returncode=returncode,
+    ))
+
+
+def run_ffmpeg(stream, label, output_path=None, quiet=True):
+    """
+    Run ffmpeg like ffmpeg-python's stream.run(overwrite_output=True, quiet=quiet),
+    recording its wall time, CPU time and output size in METRICS.
+
+    Parameters:
+        stream: An ffmpeg-python output stream, or a full ffmpeg command line.
+        label (str): Stage the run belongs to, e.g. "fade" or "merge".
+        output_path (str): File the run writes, to record its size.
+        quiet (bool): Capture ffmpeg's output instead of passing it through.
+
+    Raises:
+        ffmpeg.Error: If ffmpeg exits non-zero, with its stderr when quiet.
+    """
+    args = stream if isinstance(stream, list) else ffmpeg.compile(stream, overwrite_output=True)
+    started_at = time.time()
+    start = time.perf_counter()
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            args,
+            stdout=subprocess.DEVNULL if quiet else None,
+            stderr=stderr if quiet else None,
+        )
+        returncode, cpu_seconds = wait_process(process)
+        record_ffmpeg(label, output_path, started_at, time.perf_counter() - start, returncode, cpu_seconds)
+        if returncode != 0:
+            stderr.seek(0)
+            raise ffmpeg.Error(args[0], b"", stderr.read())
@@ -0,0 +1,258 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+from instrumentation import span
+from telemetry import TIMESTAMP, X, Y, Z, load_stream, load_telemetry, save_stream, sidecar_path
+
+# Moving average window used for the interest signal of a whole video
+INTEREST_SMOOTHING_WINDOW = 300
+# Smoothed interest level above which a stretch of video is suggested as a segment
+SUGGESTED_SEGMENT_THRESHOLD = 10
+
+# Bucket sizes of the interest pyramid levels, in seconds, finest first
+PYRAMID_RESOLUTIONS = (1, 10, 60)
+# Column layout of an interest pyramid: one row per bucket, levels stacked finest first
+RESOLUTION, BUCKET_START, BUCKET_MIN, BUCKET_MAX, BUCKET_MEAN, BUCKET_COUNT = range(6)
+PYRAMID_COLUMNS = ("resolution", "start", "min", "max", "mean", "count")
+
+
+def merge_streams(*streams: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Merge telemetry streams into one timestamp-sorted interest signal.
+
+    The interest of a sample is x + y + z. When several samples share a
+    timestamp, the first one (in stream order) wins.
+
+    Args:
+        streams: (N, 4) timestamp/x/y/z arrays.
+
+    Returns:
+        (timestamps, interest) arrays, sorted by timestamp with unique timestamps.
+    """
+    streams = [s for s in streams if len(s) > 0]
+    if not streams:
+        return np.empty(0), np.empty(0)
+
+    timestamps = np.concatenate([s[:, TIMESTAMP] for s in streams])
+    interest = np.concatenate([s[:, X] + s[:, Y] + s[:, Z] for s in streams])
+
+    # Streams are individually sorted, so a stable sort is a cheap run merge
+    # and keeps the earliest stream first among equal timestamps.
+    order = np.argsort(timestamps, kind="stable")
+    timestamps = timestamps[order]
+    first = np.concatenate(([True], timestamps[1:] != timestamps[:-1]))
+    return timestamps[first], interest[order[first]]
+
+
+def smooth_interest(values: np.ndarray, window_size: int = 5) -> np.ndarray:
+    """
+    Smooth interest levels using a simple moving average.
+
+    Args:
+        values: Interest levels, sorted by timestamp.
+        window_size: Number of points in the moving average window.
+
+    Returns:
+        Smoothed interest levels, same length as values.
+    """
+    if len(values) == 0:
+        return values
+    # With fewer values than the window, 'same' mode returns window_size values. Keep
+    # the first len(values), as the original dict-based implementation did.
+    return np.convolve(values, np.ones(window_size) / window_size, mode='same')[:len(values)]
+
+
+def extract_interesting_segments(
+        timestamps: np.ndarray,
+        values: np.ndarray,
+        threshold: float,
+        minimum_length: float = 1,
+        buffer: float = 0.5,
+        merge_distance: float = 3
+) -> list[tuple[float, float]]:
+    """
+    Extracts interesting segments from timestamped interest level data.
+
+    A segment runs from the first point at or above the threshold to the first
+    point below it (or the last point, if the data ends above the threshold).
+
+    Args:
+        timestamps: Sorted timestamps.
+        values: Interest level at each timestamp.
+        threshold: Interest level threshold to consider a point interesting.
+        minimum_length: Minimum length of segment to include.
+        buffer: Time to add before start and after end of each segment.
+        merge_distance: Merge segments if gap between them is less than this.
+
+    Returns:
+        List of (start, end) tuples.
+    """
+    if len(timestamps) == 0:
+        return []
+
+    # Rising/falling edges of the above-threshold mask
+    mask = np.concatenate(([False], values >= threshold, [False]))
+    edges = np.diff(mask.astype(np.int8))
+    run_starts = np.nonzero(edges == 1)[0]
+    run_stops = np.nonzero(edges == -1)[0]
+
+    starts = timestamps[run_starts]
+    ends = timestamps[np.minimum(run_stops, len(timestamps) - 1)]
+
+    keep = ends - starts >= minimum_length
+    starts = starts[keep] - buffer
+    ends = ends[keep] + buffer
+    if len(starts) == 0:
+        return []
+
+    # Merge segments that are close together
+    new_group = np.concatenate(([True], ~(starts[1:] - ends[:-1] <= merge_distance)))
+    group_firsts = np.nonzero(new_group)[0]
+    merged_starts = starts[group_firsts]
+    merged_ends = np.maximum.reduceat(ends, group_firsts)
+
+    return list(zip(merged_starts.tolist(), merged_ends.tolist()))
+
+
+def compute_interest(accel: np.ndarray, gyro: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The smoothed interest signal of a whole video, from its accel and gyro streams.
+
+    Returns:
+        (timestamps, interest) arrays, sorted by timestamp.
+    """
+    timestamps, interest = merge_streams(accel, gyro)
+    return timestamps, smooth_interest(interest, window_size=INTEREST_SMOOTHING_WINDOW)
+
+
+def downsample_interest(timestamps: np.ndarray, values: np.ndarray, resolution: float) -> np.ndarray:
+    """
+    Aggregate an interest signal into fixed size time buckets.
+
+    Buckets are aligned to multiples of the resolution, and empty buckets are left out.
+
+    Args:
+        timestamps: Sorted timestamps.
+        values: Interest level at each timestamp.
+        resolution: Bucket size in seconds.
+
+    Returns:
+        (buckets, 6) resolution/start/min/max/mean/count rows.
+    """
+    if len(timestamps) == 0:
+        return np.empty((0, len(PYRAMID_COLUMNS)))
+
+    values = np.asarray(values, dtype=np.float64)
+    buckets = np.floor(np.asarray(timestamps) / resolution).astype(np.int64)
+    firsts = np.nonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))[0]
+    counts = np.diff(np.append(firsts, len(values)))
+
+    rows = np.empty((len(firsts), len(PYRAMID_COLUMNS)))
+    rows[:, RESOLUTION] = resolution
+    rows[:, BUCKET_START] = buckets[firsts] * resolution
+    rows[:, BUCKET_MIN] = np.minimum.reduceat(values, firsts)
+    rows[:, BUCKET_MAX] = np.maximum.reduceat(values, firsts)
+    rows[:, BUCKET_MEAN] = np.add.reduceat(values, firsts) / counts
+    rows[:, BUCKET_COUNT] = counts
+    return rows
+
+
+def build_interest_pyramid(
+        timestamps: np.ndarray,
+        values: np.ndarray,
+        resolutions: tuple = PYRAMID_RESOLUTIONS,
+) -> np.ndarray:
+    """
+    Downsample an interest signal at several resolutions.
+
+    Every level is aggregated from the raw signal, so min/max are exact at each level.
+
+    Returns:
+        (buckets, 6) resolution/start/min/max/mean/count rows, levels stacked finest first.
+    """
+    return np.concatenate([downsample_interest(timestamps, values, r) for r in sorted(resolutions)])
+
+
+def interest_pyramid_path(filepath):
+    """
+    Path of the cached interest pyramid for a video, e.g. GX010180.interest.npy
+    """
+    return sidecar_path(filepath, "interest")
+
+
+def load_interest_pyramid(filepath, interest: Optional[tuple[np.ndarray, np.ndarray]] = None) -> np.ndarray:
+    """
+    Load a video's interest pyramid, computing and caching it next to the video on first use.
+
+    The cache is rebuilt if the video's gyro telemetry sidecar is newer than it.
+
+    Args:
+        filepath: Path to the MP4 file.
+        interest: The video's (timestamps, interest) from compute_interest, if the caller
+            already has it, to build the pyramid from instead of computing it again.
+
+    Returns:
+        Memory-mapped (buckets, 6) pyramid, see build_interest_pyramid.
+    """
+    pyramid_filepath = interest_pyramid_path(filepath)
+    try:
+        pyramid_mtime = os.path.getmtime(pyramid_filepath)
+        telemetry_mtime = os.path.getmtime(sidecar_path(filepath, "gyro"))
+        if pyramid_mtime >= telemetry_mtime:
+            pyramid = load_stream(pyramid_filepath)
+            return pyramid if len(pyramid) else np.empty((0, len(PYRAMID_COLUMNS)))
+    except FileNotFoundError:
+        pass
+
+    if interest is None:
+        telemetry = load_telemetry(filepath)
+        with span("interest", os.path.basename(filepath), profile=True):
+            interest = compute_interest(telemetry.accel, telemetry.gyro)
+    pyramid = build_interest_pyramid(*interest)
+    save_stream(pyramid_filepath, pyramid)
+    print(f"Cached interest pyramid for {filepath}: {len(pyramid)} buckets")
+    return load_stream(pyramid_filepath) if len(pyramid) else pyramid
+
+
+def query_interest_pyramid(pyramid: np.ndarray, start_time: float, end_time: float, points: int) -> np.ndarray:
+    """
+    The buckets of the finest pyramid level that covers a time window in at most `points` rows.
+
+    If even the coarsest level has too many buckets in the window, runs of consecutive
+    buckets are merged until it fits.
+
+    Args:
+        pyramid: Pyramid from build_interest_pyramid.
+        start_time: Start of the window in seconds.
+        end_time: End of the window in seconds.
+        points: Maximum number of rows to return.
+
+    Returns:
+        (rows, 6) resolution/start/min/max/mean/count rows.
+    """
+    rows = np.empty((0, len(PYRAMID_COLUMNS)))
+    if len(pyramid) == 0:
+        return rows
+    for resolution in np.unique(pyramid[:, RESOLUTION]):
+        level = pyramid[pyramid[:, RESOLUTION] == resolution]
+        starts = level[:, BUCKET_START]
+        # Include the bucket that contains start_time
+        lower = np.searchsorted(starts, start_time - resolution, side="right")
+        upper = np.searchsorted(starts, end_time, side="right")
+        rows = level[lower:upper]
+        if len(rows) <= points:
+            return np.array(rows)
+
+    factor = -(-len(rows) // points)
+    firsts = np.arange(0, len(rows), factor)
+    counts = np.add.reduceat(rows[:, BUCKET_COUNT], firsts)
+    merged = np.empty((len(firsts), len(PYRAMID_COLUMNS)))
+    merged[:, RESOLUTION] = rows[0, RESOLUTION] * factor
+    merged[:, BUCKET_START] = rows[firsts, BUCKET_START]
+    merged[:, BUCKET_MIN] = np.minimum.reduceat(rows[:, BUCKET_MIN], firsts)
+    merged[:, BUCKET_MAX] = np.maximum.reduceat(rows[:, BUCKET_MAX], firsts)
+    merged[:, BUCKET_MEAN] = np.add.reduceat(rows[:, BUCKET_MEAN] * rows[:, BUCKET_COUNT], firsts) / counts
+    merged[:, BUCKET_COUNT] = counts
+    return merged
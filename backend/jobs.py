@@ -0,0 +1,284 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import uuid
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+from encoder_profiles import EncoderProfileName
+from instrumentation import METRICS, TimingReport
+
+JOBS_DIR = "jobs"
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 1))
+# Progress is persisted at most this often per job. Status changes always are.
+PROGRESS_SAVE_INTERVAL = 1.0
+
+JobStatus = Literal["queued", "running", "completed", "failed", "cancelled"]
+UNFINISHED = ("queued", "running")
+
+
+class RenderJobSegment(BaseModel):
+    video_slug: str
+    start_time: float
+    end_time: float
+    done: bool = False
+
+
+class RenderJob(BaseModel):
+    id: str
+    project_slug: str
+    fast: bool = False
+    draft: bool = False
+    profile: Optional[EncoderProfileName] = None
+    status: JobStatus = "queued"
+    stage: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    completed_segments: int = 0
+    total_segments: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    segments: list[RenderJobSegment] = []
+    output_path: Optional[str] = None
+    error: Optional[str] = None
+    timings: Optional[TimingReport] = None
+
+
+def _run_job(job_id, project_data, fast, draft, profile, events):
+    """
+    Worker process entry point. Renders the final cut and reports progress as
+    (job_id, event, payload) tuples on the events queue.
+    """
+    # Own process group, so cancelling also kills the ffmpeg processes we spawn
+    os.setpgrp()
+
+    from merge_segments import make_final_cut
+    from models import Project
+
+    def progress(stage, completed, total, index):
+        events.put((job_id, "progress", (stage, completed, total, index)))
+
+    try:
+        output_path = make_final_cut(Project(**project_data), progress=progress, fast=fast, draft=draft, profile=profile)
+        events.put((job_id, "timings", METRICS.snapshot()))
+        events.put((job_id, "completed", output_path))
+    except Exception as e:
+        events.put((job_id, "timings", METRICS.snapshot()))
+        events.put((job_id, "failed", f"{type(e).__name__}: {e}"))
+
+
+def _kill_job_process(process):
+    """
+    Terminate a render process and the ffmpeg processes in its process group.
+
+    A process still starting up hasn't created its group yet, so it is terminated on
+    its own. It can't have started any ffmpeg processes before creating the group.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        process.terminate()
+
+
+class JobQueue:
+    """
+    Runs final cut renders in worker processes, at most `max_workers` at a time.
+
+    Each job's state is persisted to jobs/<id>.json, and the snapshot of the project's
+    cut list it renders to jobs/<id>.project.json, once at submit. Unfinished jobs are
+    resumed after a restart.
+    """
+
+    def __init__(self, jobs_dir=JOBS_DIR, max_workers=RENDER_WORKERS):
+        self.jobs_dir = jobs_dir
+        self.max_workers = max_workers
+        self._jobs: dict[str, RenderJob] = {}
+        self._projects: dict[str, dict] = {}
+        self._processes: dict[str, multiprocessing.Process] = {}
+        self._saved_at: dict[str, float] = {}
+        self._pending = queue.Queue()
+        self._slots = threading.Semaphore(max_workers)
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context("spawn")
+        self._events = None
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._events = self._context.Queue()
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+        for filename in sorted(os.listdir(self.jobs_dir)):
+            if not filename.endswith(".json") or filename.endswith(".project.json"):
+                continue
+            with open(os.path.join(self.jobs_dir, filename), "r") as f:
+                data = json.load(f)
+            job = RenderJob(**data["job"])
+            if "project" in data:
+                # Written before snapshots got their own file
+                self._projects[job.id] = data["project"]
+                self._save_project(job.id)
+                self._save(job)
+            else:
+                with open(self._project_filepath(job.id), "r") as f:
+                    self._projects[job.id] = json.load(f)
+            self._jobs[job.id] = job
+            if job.status in UNFINISHED:
+                print(f"Resuming render job {job.id} for {job.project_slug}")
+                job.status = "queued"
+                self._save(job)
+                self._pending.put(job.id)
+
+        threading.Thread(target=self._dispatch, name="render-dispatch", daemon=True).start()
+        threading.Thread(target=self._listen, name="render-events", daemon=True).start()
+
+    def submit(self, project, fast=False, draft=False, profile=None) -> RenderJob:
+        from merge_segments import final_cut_segments
+
+        project_data = project.model_dump(
+            exclude={"videos": {"__all__": {"interest_levels", "suggested_segments"}}}
+        )
+        segments = [
+            RenderJobSegment(video_slug=video.slug, start_time=segment.start_time, end_time=segment.end_time)
+            for video, segment in final_cut_segments(project)
+        ]
+        job = RenderJob(
+            id=uuid.uuid4().hex,
+            project_slug=project.slug,
+            fast=fast,
+            draft=draft,
+            profile=profile,
+            created_at=time.time(),
+            total_segments=len(segments),
+            segments=segments,
+        )
+        with self._lock:
+            self._jobs[job.id] = job
+            self._projects[job.id] = project_data
+            self._save_project(job.id)
+            self._save(job)
+        self._pending.put(job.id)
+        return job
+
+    def get(self, job_id) -> Optional[RenderJob]:
+        return self._jobs.get(job_id)
+
+    def list(self, project_slug=None) -> list[RenderJob]:
+        jobs = sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+        if project_slug is not None:
+            jobs = [job for job in jobs if job.project_slug == project_slug]
+        return jobs
+
+    def cancel(self, job_id) -> Optional[RenderJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in UNFINISHED:
+                return job
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            self._save(job)
+            process = self._processes.get(job_id)
+        if process is not None and process.pid is not None:
+            _kill_job_process(process)
+        return job
+
+    def _project_filepath(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.project.json")
+
+    def _save_project(self, job_id):
+        filepath = self._project_filepath(job_id)
+        tmp_filepath = f"{filepath}.tmp"
+        with open(tmp_filepath, "w") as f:
+            json.dump(self._projects[job_id], f)
+        os.replace(tmp_filepath, filepath)
+
+    def _save(self, job: RenderJob):
+        filepath = os.path.join(self.jobs_dir, f"{job.id}.json")
+        tmp_filepath = f"{filepath}.tmp"
+        with open(tmp_filepath, "w") as f:
+            json.dump({"job": job.model_dump()}, f)
+        os.replace(tmp_filepath, filepath)
+        self._saved_at[job.id] = time.monotonic()
+
+    def _dispatch(self):
+        while True:
+            job_id = self._pending.get()
+            self._slots.acquire()
+            with self._lock:
+                job = self._jobs[job_id]
+                if job.status != "queued":
+                    self._slots.release()
+                    continue
+                process = self._context.Process(
+                    target=_run_job,
+                    args=(job_id, self._projects[job_id], job.fast, job.draft, job.profile, self._events),
+                    name=f"render-{job_id}",
+                )
+                job.status = "running"
+                job.started_at = time.time()
+                self._save(job)
+                self._processes[job_id] = process
+                process.start()
+            print(f"Started render job {job_id} for {job.project_slug}")
+            threading.Thread(target=self._wait, args=(job_id, process), daemon=True).start()
+
+    def _wait(self, job_id, process):
+        process.join()
+        with self._lock:
+            self._processes.pop(job_id, None)
+            job = self._jobs[job_id]
+            if job.status == "cancelled":
+                # Kill any ffmpeg processes the render started after it was cancelled
+                with contextlib.suppress(ProcessLookupError):
+                    os.killpg(process.pid, signal.SIGTERM)
+            if job.status == "running" and process.exitcode != 0:
+                # Died without reporting a result, e.g. killed by the OOM killer
+                job.status = "failed"
+                job.error = job.error or f"Render process exited with code {process.exitcode}"
+                job.finished_at = time.time()
+                self._save(job)
+        self._slots.release()
+
+    def _listen(self):
+        while True:
+            job_id, event, payload = self._events.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.status != "running":
+                    continue
+                if event == "progress":
+                    stage, completed, total, index = payload
+                    job.stage = stage
+                    if stage == "segment":
+                        job.completed_segments = completed
+                        job.segments[index].done = True
+                    elif stage == "cache":
+                        job.cache_hits = completed
+                        job.cache_misses = total - completed
+                elif event == "timings":
+                    job.timings = payload
+                    METRICS.merge(payload)
+                elif event == "completed":
+                    job.status = "completed"
+                    job.output_path = payload
+                    job.finished_at = time.time()
+                elif event == "failed":
+                    job.status = "failed"
+                    job.error = payload
+                    job.finished_at = time.time()
+                if event == "progress" and time.monotonic() - self._saved_at.get(job_id, 0) < PROGRESS_SAVE_INTERVAL:
+                    # Progress lost in a crash is redone on resume anyway
+                    continue
+                self._save(job)
+
+
+JOB_QUEUE = JobQueue()
@@ -1,17 +1,27 @@
 import os
-from http.client import HTTPException
-from typing import List
+from typing import List, Literal, Optional
 
+import numpy as np
 import sentry_sdk
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.models import Response
 from fastapi.staticfiles import StaticFiles
 from starlette.requests import Request
-from starlette.responses import FileResponse, RedirectResponse
-
-from merge_segments import make_final_cut
-from models import get_all_projects, get_project as get_p, Project, Video, Segment
+from starlette.responses import FileResponse, RedirectResponse, Response
+
+from catalog import CATALOG, get_all_projects, get_project as get_p, get_video as get_v
+from interest import BUCKET_MAX, BUCKET_MEAN, BUCKET_MIN, BUCKET_START, RESOLUTION, query_interest_pyramid
+from encoder_profiles import ENCODER_PROFILES, EncoderProfileName
+from ingest import INGEST_QUEUE, VideoAnalysis
+from instrumentation import METRICS, TimingReport
+from jobs import JOB_QUEUE, RenderJob
+from media import media_response
+from merge_segments import render_segment
+from models import InterestSeries, ProjectSummary, SegmentDiff, Video, VideoSummary, Segment
+from orientation import slice_track
+from render_cache import RenderCache
+from telemetry import COLUMNS, encode_stream
 
 sentry_sdk.init(
     dsn="https://e88a3329c652d147a4947c6eb3af0539@o4509101771259904.ingest.us.sentry.io/4509101773029376",
@@ -26,6 +36,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Columns", "X-Total-Count"],
 )
 
 from starlette.staticfiles import StaticFiles
@@ -42,122 +53,270 @@ app.mount("/static/projects/", StaticFiles(directory="projects"), name="projects
 app.mount("/assets/", StaticFiles(directory="static/assets"), name="assets")
 
 
+@app.on_event("startup")
+async def watch_projects():
+    CATALOG.watch()
+
+
+@app.on_event("startup")
+async def start_render_jobs():
+    JOB_QUEUE.start()
+
+
+@app.on_event("startup")
+async def start_ingest():
+    INGEST_QUEUE.start()
+
+
 @app.get("/")
 async def root():
     return RedirectResponse(url="/projects")
 
 
 @app.get("/api/projects")
-async def get_projects() -> list[Project]:
-    return get_all_projects()
+async def get_projects() -> list[ProjectSummary]:
+    return [ProjectSummary.from_project(project) for project in get_all_projects()]
 
 
 @app.get("/api/project/{project_slug}")
-async def get_project(project_slug: str) -> Project:
+async def get_project(project_slug: str) -> ProjectSummary:
     project = get_p(project_slug)
     if project is None:
         raise HTTPException(status_code=404, detail="Project not found")
-    return project
+    return ProjectSummary.from_project(project)
 
 
 @app.get("/api/project/{project_slug}/calculate")
-async def get_project(project_slug: str) -> Project:
+async def get_project(project_slug: str) -> ProjectSummary:
     project = get_p(project_slug)
-    for video in project.videos:
-        video.calculate_suggested_segments()
     if project is None:
         raise HTTPException(status_code=404, detail="Project not found")
-    return project
+    for video in project.videos:
+        video.calculate_suggested_segments()
+    return ProjectSummary.from_project(project)
 
 @app.get("/api/project/{project_slug}/videos")
-async def get_videos(project_slug: str) -> List[Video]:
+async def get_videos(project_slug: str) -> List[VideoSummary]:
     project = get_p(project_slug)
     if project is None:
         raise HTTPException(status_code=404, detail="Project not found")
-    return project.videos
+    return [VideoSummary.from_video(video) for video in project.videos]
 
 
 @app.get("/api/project/{project_slug}/video/{video_slug}")
 async def get_video(project_slug: str, video_slug: str) -> Video:
-    project = get_p(project_slug)
-    if project is None:
+    video = get_v(project_slug, video_slug)
+    if video is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    analysis = INGEST_QUEUE.get(project_slug, video_slug)
+    if analysis is not None and analysis.status == "done":
+        # Reads the segments the analysis saved
+        video.calculate_suggested_segments()
+    else:
+        # Don't analyse inside the request. Move it up the queue and return what we have.
+        INGEST_QUEUE.prioritise(get_p(project_slug), video)
+    return video
+
+
+@app.get("/api/project/{project_slug}/analysis")
+async def get_project_analysis(project_slug: str) -> List[VideoAnalysis]:
+    if get_p(project_slug) is None:
         raise HTTPException(status_code=404, detail="Project not found")
-    for video in project.videos:
-        if video.slug == video_slug:
-            video.calculate_suggested_segments()
-            return video
-    raise HTTPException(status_code=404, detail="Video not found")
+    return INGEST_QUEUE.list(project_slug)
+
+
+@app.get("/api/project/{project_slug}/video/{video_slug}/analysis")
+async def get_video_analysis(project_slug: str, video_slug: str) -> VideoAnalysis:
+    analysis = INGEST_QUEUE.get(project_slug, video_slug)
+    if analysis is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return analysis
+
+
+@app.get("/api/project/{project_slug}/video/{video_slug}/interest")
+def get_video_interest(
+    project_slug: str,
+    video_slug: str,
+    start: float = 0,
+    end: Optional[float] = None,
+    points: int = Query(default=1000, ge=1, le=100000),
+) -> InterestSeries:
+    """
+    Interest levels between start and end (default: the whole video), downsampled to at
+    most `points` buckets from the video's precomputed interest pyramid.
+    """
+    video = get_v(project_slug, video_slug)
+    if video is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    rows = query_interest_pyramid(video.interest_pyramid(), start, video.length if end is None else end, points)
+    return InterestSeries(
+        resolution=float(rows[0, RESOLUTION]) if len(rows) else 0,
+        timestamps=rows[:, BUCKET_START].tolist(),
+        min=rows[:, BUCKET_MIN].tolist(),
+        max=rows[:, BUCKET_MAX].tolist(),
+        mean=rows[:, BUCKET_MEAN].tolist(),
+    )
+
+
+@app.get("/api/project/{project_slug}/video/{video_slug}/telemetry/{stream}")
+def get_video_telemetry(
+    project_slug: str,
+    video_slug: str,
+    stream: Literal["accel", "gyro"],
+    start: float = 0,
+    end: Optional[float] = None,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=100000, ge=1, le=1000000),
+) -> Response:
+    """
+    Raw telemetry samples between start and end, as little-endian float32 timestamp/x/y/z rows.
+
+    Samples in the window are paged with offset/limit. X-Total-Count is the number of
+    samples in the whole window.
+    """
+    video = get_v(project_slug, video_slug)
+    if video is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    samples = getattr(video, stream)
+    window = slice_track(samples, start, np.inf if end is None else end)
+    return Response(
+        content=encode_stream(window[offset:offset + limit]),
+        media_type="application/octet-stream",
+        headers={"X-Columns": ",".join(COLUMNS), "X-Total-Count": str(len(window))},
+    )
 
 
 @app.get("/api/project/{project_slug}/final")
 async def build_final_cut(
-    project_slug: str,
-    background_tasks: BackgroundTasks,
-) -> None:
-    print("Building final cut...")
+    project_slug: str, fast: bool = False, draft: bool = False, profile: Optional[EncoderProfileName] = None
+) -> RenderJob:
+    """
+    Queue a final cut render. `profile` picks the encoder profile (draft, review or
+    master), and draft is short for the draft profile.
+    """
     project = get_p(project_slug)
     if project is None:
-        raise HTTPException()
+        raise HTTPException(status_code=404, detail="Project not found")
+    job = JOB_QUEUE.submit(project, fast=fast, draft=draft, profile=profile)
+    print(f"Queued {profile or ('draft' if draft else 'default')} profile final cut job {job.id} for {project_slug}")
+    return job
+
+
+@app.get("/api/project/{project_slug}/jobs")
+async def get_project_jobs(project_slug: str) -> List[RenderJob]:
+    return JOB_QUEUE.list(project_slug)
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str) -> RenderJob:
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/api/jobs/{job_id}/timings")
+async def get_job_timings(job_id: str) -> TimingReport:
+    """
+    Where a finished render job spent its time, per stage and per ffmpeg run.
+    """
+    job = JOB_QUEUE.get(job_id)
+    if job is None or job.timings is None:
+        raise HTTPException(status_code=404, detail="Job timings not found")
+    return job.timings
+
+
+@app.get("/api/metrics")
+async def get_metrics() -> TimingReport:
+    """
+    Stage timings and recent ffmpeg runs of this server, its render jobs and its
+    ingest workers, since startup.
+    """
+    return METRICS.snapshot()
 
 
-    make_final_cut(project)
-    print("Processed videos...")
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str) -> RenderJob:
+    job = JOB_QUEUE.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 
 @app.post("/api/project/{project_slug}/video/{video_slug}/segments")
 async def set_video_segments(
     project_slug: str, video_slug: str, segments: List[Segment]
 ) -> Video:
-    project = get_p(project_slug)
-    if project is None:
-        raise HTTPException(status_code=404, detail="Project not found")
-    for video in project.videos:
-        if video.slug == video_slug:
-            video.calculate_suggested_segments()
-            video.segments = segments
-            video.write_segments()
-            return video
-    raise HTTPException(status_code=404, detail="Video not found")
+    video = get_v(project_slug, video_slug)
+    if video is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    video.segments = segments
+    video.write_segments()
+    return video
+
+
+@app.patch("/api/project/{project_slug}/segments")
+async def update_segments(project_slug: str, diffs: List[SegmentDiff]) -> List[VideoSummary]:
+    """
+    Apply segment edits to any number of videos in a project at once.
+
+    Returns as soon as the edits are applied in memory. They are saved in the
+    background, with rapid edits to the same video coalesced into one write.
+    """
+    videos = [get_v(project_slug, diff.video_slug) for diff in diffs]
+    missing = [diff.video_slug for diff, video in zip(diffs, videos) if video is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Videos not found: {', '.join(missing)}")
+    for diff, video in zip(diffs, videos):
+        video.apply_segment_diff(diff)
+        video.write_segments()
+    return [VideoSummary.from_video(video) for video in videos]
 
 
 @app.get("/api/project/{project_slug}/video/{video_slug}/thumbnail")
-async def get_video_segments(project_slug: str, video_slug: str) -> FileResponse:
-    project = get_p(project_slug)
-    if project is None:
-        raise HTTPException(status_code=404, detail="Project not found")
-    for video in project.videos:
-        if video.slug == video_slug:
-            if video.thumbnail_filename is not None:
-                return FileResponse(
-                    os.path.join("./projects", project.name, video.thumbnail_filename),
-                    media_type="image/jpeg",
-                    filename=video.thumbnail_filename,
-                    headers={
-                        "Content-Disposition": f"inline; filename={video.thumbnail_filename}",
-                        "Cross-Origin-Embedder-Policy": "require-corp",
-                        "Cross-Origin-Resource-Policy": "*",
-                    }
-                )
-
-    raise HTTPException(status_code=404, detail="Video not found")
+async def get_video_segments(project_slug: str, video_slug: str, request: Request) -> FileResponse:
+    video = get_v(project_slug, video_slug)
+    if video is None or video.thumbnail_filename is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return media_response(
+        request,
+        os.path.join("./projects", video.project_dir_name, video.thumbnail_filename),
+        media_type="image/jpeg",
+        immutable=True,
+        filename=video.thumbnail_filename,
+    )
 
 
 @app.get("/api/project/{project_slug}/video/{video_slug}/preview")
-async def get_video_preview(project_slug: str, video_slug: str) -> FileResponse:
-    project = get_p(project_slug)
-    for video in project.videos:
-        if video.slug == video_slug:
-            if video.lrv_filename is not None:
-                return FileResponse(
-                    os.path.join("./projects", project.name, video.lrv_filename),
-                    media_type="video/mp4",
-                    filename=video.lrv_filename,
-                    headers={
-                        "Content-Disposition": f"inline; filename={video.lrv_filename}",
-                        "Cross-Origin-Embedder-Policy": "require-corp",
-                        "Cross-Origin-Resource-Policy": "*",
-                    }
-                )
+async def get_video_preview(project_slug: str, video_slug: str, request: Request) -> FileResponse:
+    video = get_v(project_slug, video_slug)
+    if video is None or video.lrv_filename is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return media_response(
+        request,
+        os.path.join("./projects", video.project_dir_name, video.lrv_filename),
+        media_type="video/mp4",
+        filename=video.lrv_filename,
+    )
+
+
+@app.get("/api/project/{project_slug}/video/{video_slug}/segment/{segment_index}/preview")
+def get_segment_preview(project_slug: str, video_slug: str, segment_index: int, request: Request) -> FileResponse:
+    """
+    A draft render of one segment, cut from the LRV proxy. Renders on first request.
+    """
+    video = get_v(project_slug, video_slug)
+    if video is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    if not 0 <= segment_index < len(video.segments):
+        raise HTTPException(status_code=404, detail="Segment not found")
+    cache = RenderCache(os.path.join("./projects", video.project_dir_name, "segments"))
+    try:
+        preview_filepath = render_segment(video, video.segments[segment_index], cache, profile=ENCODER_PROFILES["draft"])
+    finally:
+        cache.save()
+    # Renders are named after their content, so they never change under the same name
+    return media_response(request, preview_filepath, media_type="video/mp4", immutable=True)
 
 
 @app.get("/{filepath:path}")
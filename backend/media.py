@@ -0,0 +1,84 @@
+import os
+from email.utils import parsedate_to_datetime
+
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+
+# Camera-written files (thumbnails) never change under the same name
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Cacheable, but revalidated with the ETag on every use
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+CROSS_ORIGIN_HEADERS = {
+    "Cross-Origin-Embedder-Policy": "require-corp",
+    "Cross-Origin-Resource-Policy": "*",
+}
+
+
+def is_not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """
+    Whether a conditional GET can be answered with 304 Not Modified.
+
+    If-None-Match takes precedence over If-Modified-Since, as in RFC 9110.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def media_response(request: Request, filepath, media_type, immutable=False, filename=None) -> Response:
+    """
+    Serve a media file with conditional GET and byte range support.
+
+    Range requests get 206 Partial Content (or 416), so video players only fetch
+    the bytes they play when seeking through multi-GB files. Requests whose
+    If-None-Match/If-Modified-Since match the file get an empty 304.
+
+    Parameters:
+        request (Request): The incoming request.
+        filepath (str): Path to the file to serve.
+        media_type (str): Content type of the file.
+        immutable (bool): Let clients cache the file for a year without revalidating.
+        filename (str): Name for the inline Content-Disposition header.
+
+    Returns:
+        Response: A FileResponse, or a 304 response.
+    """
+    try:
+        stat_result = os.stat(filepath)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    headers = {
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        **CROSS_ORIGIN_HEADERS,
+    }
+    # FileResponse handles Range/If-Range itself, and sets the ETag and Last-Modified
+    response = FileResponse(
+        filepath,
+        media_type=media_type,
+        filename=filename,
+        stat_result=stat_result,
+        headers=headers,
+        content_disposition_type="inline",
+    )
+    if request.method in ("GET", "HEAD") and is_not_modified(request, response.headers["etag"], stat_result.st_mtime):
+        return Response(
+            status_code=304,
+            headers={
+                "ETag": response.headers["etag"],
+                "Last-Modified": response.headers["last-modified"],
+                **headers,
+            },
+        )
+    return response
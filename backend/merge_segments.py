@@ -1,100 +1,111 @@
 #!/usr/bin/env python3
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import ffmpeg as ffmpeg_module
 import ffmpeg
 
-from models import Video, Segment, Project, get_all_projects
-
-def create_segment_filename(video: Video, segment: Segment):
-    """
-    Generate a file for a video segment.
-
-    Parameters:
-        video (Video): The video object.
-        segment (Segment): The segment object.
+from catalog import get_all_projects
+from encoder_profiles import EncoderProfile, get_encoder_profile
+from instrumentation import run_ffmpeg, span
+from models import Video, Segment, Project
+from render_cache import BuildManifest, RenderCache, atomic_output, remove_orphaned_outputs, source_identity
+from smart_render import concat_videos, get_stream_parameters, matching_output_options, smart_render_segment
 
-    Returns:
-        str: The filename for the segment, that has been created
-    """
-    output_path = segment.filepath(video)
-    if os.path.exists(output_path):
-        print(f"Skipping {output_path}, already exists.")
-        return output_path
+# Number of ffmpeg processes to run at once, and encoder threads for each of them
+FFMPEG_WORKERS = int(os.environ.get("FFMPEG_WORKERS", max(1, (os.cpu_count() or 1) // 4)))
+FFMPEG_THREADS = int(os.environ.get("FFMPEG_THREADS", max(1, (os.cpu_count() or 1) // FFMPEG_WORKERS)))
 
-    input_path = os.path.join("./projects", video.project_dir_name, video.mp4_filename)
-    if not os.path.exists(os.path.dirname(output_path)):
-        os.makedirs(os.path.dirname(output_path))
+FADE_DURATION = 0.25
 
-    ffmpeg.input(input_path).output(output_path, ss=segment.start_time, t=segment.end_time - segment.start_time, vcodec='libx264', acodec='aac', strict='experimental').run(overwrite_output=True)
-    print(f"Extracted segment {output_path} from {input_path}")
-    return output_path
 
-def fade_video(input_path, output_path, fade_duration=0.25):
+def extract_faded_segment(video: Video, segment: Segment, output_path, fade_duration=FADE_DURATION, threads=FFMPEG_THREADS, profile: EncoderProfile = None):
     """
-    Apply fade in/out effect to a video.
+    Cut a segment out of its video with a fade in/out, in a single ffmpeg pass.
+
+    Seeks, trims, fades video and audio and encodes them together, so the segment
+    is only decoded and encoded once and no intermediate file is written.
 
     Parameters:
-        input_path (str): Path to the input video.
-        output_path (str): Path to save the processed video.
+        video (Video): The video object.
+        segment (Segment): The segment object.
+        output_path (str): Path to save the faded segment.
         fade_duration (float): Duration of the fade in/out in seconds.
+        threads (int): Number of encoder threads for ffmpeg.
+        profile (EncoderProfile): How to encode the segment, and whether to cut it from the
+            LRV proxy. Defaults to the default encoder profile.
     """
-    # Get video duration
-    try:
-        probe = ffmpeg.probe(input_path)
-        video_stream = next(s for s in probe['streams'] if s['codec_type'] == 'video')
-        duration = float(video_stream['duration'])
-    except Exception as e:
-        print(f"Error reading {input_path}: {e}")
-        return
+    profile = profile or get_encoder_profile()
+    input_path = video.filepath(profile.proxy)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    # Segments are padded and can run past either end of the video
+    start_time = max(segment.start_time, 0)
+    end_time = min(segment.end_time, video.length)
+    duration = end_time - start_time
+    source = ffmpeg.input(input_path, ss=start_time, t=duration)
+    video_stream = profile.scale(source.video)
+    audio_stream = source.audio
 
     # Calculate fade out start time
     fade_out_start = duration - fade_duration
-    if fade_out_start <= 0:
-        print(f"Video too short to apply fade: {input_path}")
-        return
-
-    # Apply fade in and fade out
-    try:
-        (
-            ffmpeg
-            .input(input_path)
-            .video
+    if fade_out_start > 0:
+        video_stream = (
+            video_stream
             .filter('fade', type='in', start_time=0, duration=fade_duration)
             .filter('fade', type='out', start_time=fade_out_start, duration=fade_duration)
-            .output(output_path, vcodec='libx264', acodec='aac', strict='experimental')
-            .run(overwrite_output=True)
         )
-        print(f"Processed {input_path} -> {output_path}")
-    except ffmpeg.Error as e:
-        print(f"FFmpeg error for {input_path}: {e.stderr.decode()}")
+        audio_stream = (
+            audio_stream
+            .filter('afade', type='in', start_time=0, duration=fade_duration)
+            .filter('afade', type='out', start_time=fade_out_start, duration=fade_duration)
+        )
+    else:
+        print(f"Segment too short to apply fade: {output_path}")
+
+    with span("fade", os.path.basename(output_path)):
+        run_ffmpeg(
+            ffmpeg.output(video_stream, audio_stream, output_path, **profile.output_options(threads)),
+            "fade", output_path,
+        )
+    print(f"Extracted segment {output_path} from {input_path}")
+    return output_path
 
-def merge_videos(video_paths, output_path):
+def merge_videos(video_paths, output_path, threads=FFMPEG_THREADS, profile: EncoderProfile = None):
     """
     Merge multiple MP4 videos into a single video.
 
     Parameters:
         video_paths (list of str): List of paths to input MP4 files.
         output_path (str): Path to save the merged video.
+        threads (int): Number of encoder threads for ffmpeg.
+        profile (EncoderProfile): How to encode the merged video. Defaults to the default
+            encoder profile.
     """
+    profile = profile or get_encoder_profile()
     if len(video_paths) == 0:
         raise ValueError("No videos provided for merging.")
 
-    # Create a list of input streams
-    inputs = [ffmpeg.input(v) for v in video_paths]
+    # Create a list of interleaved video/audio input streams
+    streams = []
+    for v in video_paths:
+        source = ffmpeg.input(v)
+        streams += [source.video, source.audio]
 
     # Concatenate videos with re-encoding
     try:
-        (
-            ffmpeg
-            .concat(*inputs, v=1, a=1)
-            .output(output_path, vcodec='libx264', acodec='aac')
-            .run(overwrite_output=True)
-        )
+        with span("merge", os.path.basename(output_path)):
+            run_ffmpeg(
+                ffmpeg.concat(*streams, v=1, a=1).output(output_path, **profile.output_options(threads)),
+                "merge", output_path,
+            )
         print(f"Merged {len(video_paths)} videos into {output_path}")
     except ffmpeg.Error as e:
         print(f"Error merging videos: {e.stderr.decode()}")
+        raise
 
-def create_title_card(title, subtitle, output_path, duration=3, resolution=(1280, 720), font_size=48, subtitle_font_size=30):
+def create_title_card(title, subtitle, output_path, duration=3, resolution=(1280, 720), font_size=48, subtitle_font_size=30, threads=FFMPEG_THREADS, profile: EncoderProfile = None, output_options=None):
     """
     Creates a title card video with centered title and subtitle.
 
@@ -106,12 +117,20 @@ def create_title_card(title, subtitle, output_path, duration=3, resolution=(1280
         resolution (tuple): Video resolution (width, height).
         font_size (int): Font size for the title.
         subtitle_font_size (int): Font size for the subtitle.
+        threads (int): Number of encoder threads for ffmpeg.
+        profile (EncoderProfile): How to encode the card. It is scaled like the segments of
+            the same resolution. Defaults to the default encoder profile.
+        output_options (dict): Extra ffmpeg output options, e.g. to match the segments' encoding.
     """
+    profile = profile or get_encoder_profile()
     width, height = resolution
     title_y = "(h/2 - 60)"
     subtitle_y = "(h/2 + 20)"
 
-    (
+    # Silent audio track, so the card can be concatenated with segments that have audio
+    silence = ffmpeg.input('anullsrc=channel_layout=stereo:sample_rate=48000', f='lavfi', t=duration)
+
+    video_stream = (
         ffmpeg
         .input(f'color=c=black:s={width}x{height}:d={duration}', f='lavfi')
         .filter('drawtext',
@@ -129,9 +148,14 @@ def create_title_card(title, subtitle, output_path, duration=3, resolution=(1280
                 x='(w-text_w)/2',
                 y=subtitle_y,
                 enable='gte(t,0)')
-        .output(output_path, vcodec='libx264', pix_fmt='yuv420p')
-        .run(overwrite_output=True)
     )
+    if output_options is None:
+        video_stream = profile.scale(video_stream)
+    with span("title_card", os.path.basename(output_path)):
+        run_ffmpeg(
+            ffmpeg.output(video_stream, silence, output_path, **{**profile.output_options(threads), **(output_options or {})}),
+            "title_card", output_path,
+        )
     print(f"Title card created at {output_path}")
 
 def get_video_resolution(filepath):
@@ -145,7 +169,8 @@ def get_video_resolution(filepath):
         (int, int): Width and height of the video in pixels.
     """
     try:
-        probe = ffmpeg.probe(filepath)
+        with span("probe", os.path.basename(filepath)):
+            probe = ffmpeg.probe(filepath)
         video_stream = next(stream for stream in probe['streams'] if stream['codec_type'] == 'video')
         width = int(video_stream['width'])
         height = int(video_stream['height'])
@@ -154,34 +179,246 @@ def get_video_resolution(filepath):
         print(f"Failed to get resolution for {filepath}: {e}")
         return None, None
 
-def make_final_cut(project: Project):
-    completed_fading_segments = []
-    total_segments = sum([len(video.segments) for video in project.videos])
-    curr_segment = 0
-    videos = project.videos
-    videos.sort(key=lambda x: x.mp4_filename)
+def final_cut_segments(project: Project) -> list[tuple[Video, Segment]]:
+    """
+    The (video, segment) pairs that make up a project's final cut, in render order.
+    """
+    videos = sorted(project.videos, key=lambda x: x.mp4_filename)
+    return [(video, segment) for video in videos for segment in video.segments]
+
+
+def render_segment(video: Video, segment: Segment, cache: RenderCache, threads=FFMPEG_THREADS, stream_parameters=None, fade_duration=FADE_DURATION, profile: EncoderProfile = None):
+    """
+    Extract a segment from its video and fade it in/out, reusing a cached render if
+    one exists for the same source file, cut times and encode parameters.
+
+    Parameters:
+        stream_parameters (dict): If given, smart render the segment to MPEG-TS, stream
+            copying everything but the fades.
+        profile (EncoderProfile): How to encode the segment, and whether to render it from
+            the LRV proxy. Smart renders only take its preset and CRF, as they must match
+            the source's format. Defaults to the default encoder profile.
+
+    Returns:
+        str: Path to the faded segment.
+    """
+    profile = profile or get_encoder_profile()
+    input_path = video.filepath(profile.proxy)
+    params = {
+        "start_time": segment.start_time,
+        "end_time": segment.end_time,
+        "fade_duration": fade_duration,
+    }
+
+    if stream_parameters is not None:
+        encoder_options = profile.encoder_options()
+        params.update(mode="smart", stream_parameters=stream_parameters, output_options={**matching_output_options(stream_parameters), **encoder_options})
+        return cache.get_or_render(
+            "segment", [input_path], params, ".ts",
+            lambda output_path: smart_render_segment(input_path, segment.start_time, segment.end_time, output_path, stream_parameters, fade_duration=fade_duration, threads=threads, encoder_options=encoder_options),
+        )
+
+    params.update(mode="reencode", encoding=profile.cache_params())
+    return cache.get_or_render(
+        "segment", [input_path], params, ".mp4",
+        lambda output_path: extract_faded_segment(video, segment, output_path, fade_duration=fade_duration, threads=threads, profile=profile),
+    )
+
+
+def render_title_card(cache: RenderCache, title, subtitle, resolution, duration=3, font_size=48, subtitle_font_size=30, threads=FFMPEG_THREADS, profile: EncoderProfile = None, output_options=None):
+    """
+    Create a title card with create_title_card, reusing a cached one with the same text and encoding.
+
+    Returns:
+        str: Path to the title card.
+    """
+    profile = profile or get_encoder_profile()
+    params = {
+        "title": title,
+        "subtitle": subtitle,
+        "resolution": list(resolution),
+        "duration": duration,
+        "font_size": font_size,
+        "subtitle_font_size": subtitle_font_size,
+        "encoding": profile.cache_params(),
+        "output_options": output_options,
+    }
+    ext = ".ts" if (output_options or {}).get("f") == "mpegts" else ".mp4"
+    return cache.get_or_render(
+        "title_card", [], params, ext,
+        lambda output_path: create_title_card(title, subtitle, output_path, duration=duration, resolution=resolution, font_size=font_size, subtitle_font_size=subtitle_font_size, threads=threads, profile=profile, output_options=output_options),
+    )
+
+
+def get_matching_stream_parameters(videos: list[Video], draft=False):
+    """
+    Stream parameters of each video, by mp4 filename. Returns None if the videos are
+    encoded differently or can't be smart rendered, in which case their segments
+    can't be joined with stream copy.
+    """
+    stream_parameters = {}
+    shared = None
     for video in videos:
-        print(f"Processing video {video.mp4_filename}")
-        for segment in video.segments:
-            create_segment_filename(video, segment)
-            input_path = segment.filepath(video)
-            output_path = input_path.replace('.mp4', '_faded.mp4')
-            curr_segment = curr_segment + 1
-            if os.path.exists(output_path):
-                print(f"Skipping {output_path}, already exists.")
-                completed_fading_segments.append(segment)
-                continue
-            print(f"Processing segment {curr_segment}/{total_segments}: {input_path}")
-            fade_video(input_path, output_path)
-            completed_fading_segments.append(output_path)
-
-    title_card_filepath = os.path.join("./projects", project.name, "segments", "title_card.mp4")
-    (width, height) = get_video_resolution(os.path.join("./projects",  project.name, project.videos[0].mp4_filename))
-    create_title_card("Garibaldi Neve Traverse", "Spring 2025 (John, Nick, Wilson)", title_card_filepath, duration=3, resolution=(width, height), font_size=48, subtitle_font_size=30)
-
-    completed_fading_segments = [title_card_filepath] + completed_fading_segments
-    output_path = os.path.join("./projects", project.name, "segments", "final_cut.mp4")
-    merge_videos(completed_fading_segments, output_path)
+        params = get_stream_parameters(video.filepath(draft))
+        if params is None:
+            return None
+        try:
+            matching_output_options(params)
+        except ValueError as e:
+            print(e)
+            return None
+        comparable = {k: v for k, v in params.items() if k not in ("start_time", "duration")}
+        if shared is None:
+            shared = comparable
+        elif comparable != shared:
+            print(f"{video.mp4_filename} is encoded differently from the other videos")
+            return None
+        stream_parameters[video.mp4_filename] = params
+    return stream_parameters
+
+
+def final_cut_filename(profile: EncoderProfile) -> str:
+    """
+    final_cut.mp4 for the default encoder profile, and e.g. final_cut_draft.mp4 for the others.
+    """
+    return "final_cut.mp4" if profile.name == get_encoder_profile().name else f"final_cut_{profile.name}.mp4"
+
+
+def make_final_cut(project: Project, progress=None, workers=FFMPEG_WORKERS, threads=FFMPEG_THREADS, fast=False, draft=False, profile=None):
+    """
+    Render the final cut of a project.
+
+    Segments are extracted and faded by up to `workers` concurrent ffmpeg processes,
+    each using `threads` encoder threads, and merged in their original order.
+
+    In fast mode segments are smart rendered, re-encoding only the fades and the GOPs
+    around the cut points, and joined with stream copy. It falls back to a full
+    re-encode if the source videos aren't all encoded the same way.
+
+    Builds can be restarted after a crash or cancellation. Every file is rendered to a
+    temporary name and renamed into place when it is complete, and a build manifest
+    next to the output records each completed step and its parameters. A restarted
+    build reuses the steps that completed and only renders the rest.
+
+    Every re-encode uses one encoder profile. The draft profile renders the same cut
+    list from the LRV proxies, at their lower resolution and with a faster encode, to
+    final_cut_draft.mp4. The master profile encodes slowly at high quality for the
+    final export, to final_cut_master.mp4.
+
+    Parameters:
+        project (Project): The project to render.
+        progress (callable): Optional progress(stage, completed, total, index) callback, called
+            as each segment finishes ("segment", with its index in render order), after the
+            title card ("title_card"), after the merge ("merge") and with the render cache's
+            hits out of all lookups ("cache").
+        workers (int): Number of concurrent ffmpeg processes.
+        threads (int): Number of encoder threads per ffmpeg process.
+        fast (bool): Smart render with stream copy instead of re-encoding everything.
+        draft (bool): Render with the draft profile, if no profile is given.
+        profile (str): Name of the encoder profile to render with. Defaults to the default
+            encoder profile.
+    """
+    def report(stage, completed, total, index=None):
+        if progress is not None:
+            progress(stage, completed, total, index)
+
+    segments = final_cut_segments(project)
+    total_segments = len(segments)
+    profile = get_encoder_profile(profile or ("draft" if draft else None))
+    output_path = os.path.join("./projects", project.name, "segments", final_cut_filename(profile))
+    if profile.proxy and any(video.lrv_filename is None for video in project.videos):
+        # Mixing proxy and full resolution segments would break the merge
+        print(f"Not every video has an LRV proxy, rendering the {profile.name} cut from the MP4s")
+        profile = profile.model_copy(update={"proxy": False})
+
+    faded_segments = [None] * total_segments
+    print(f"Rendering {total_segments} segments with the {profile.name} profile, {workers} ffmpeg workers x {threads} threads")
+
+    stream_parameters = None
+    title_card_options = None
+    if fast:
+        stream_parameters = get_matching_stream_parameters(list({id(video): video for video, _ in segments}.values()), draft=profile.proxy)
+        if stream_parameters is None:
+            print("Source videos can't be joined with stream copy, re-encoding the final cut")
+        else:
+            title_card_options = {**matching_output_options(next(iter(stream_parameters.values()))), **profile.encoder_options(), "f": "mpegts"}
+
+    (width, height) = get_video_resolution(project.videos[0].filepath(profile.proxy))
+    segments_dir = os.path.join("./projects", project.name, "segments")
+    remove_orphaned_outputs(segments_dir)
+    cache = RenderCache(segments_dir)
+    build = BuildManifest(output_path, {
+        "profile": profile.cache_params(),
+        "smart": stream_parameters is not None,
+        "fade_duration": FADE_DURATION,
+    })
+    started_at = time.time()
+
+    title, subtitle = "Garibaldi Neve Traverse", "Spring 2025 (John, Nick, Wilson)"
+    title_card_params = {"title": title, "subtitle": subtitle, "resolution": [width, height]}
+    segment_params = [
+        {
+            "source": source_identity(video.filepath(profile.proxy)),
+            "start_time": segment.start_time,
+            "end_time": segment.end_time,
+        }
+        for video, segment in segments
+    ]
+    resumed = sum(build.completed(f"segment_{index}", params) is not None for index, params in enumerate(segment_params))
+    if resumed:
+        print(f"Resuming build of {output_path}: {resumed}/{total_segments} segments already rendered")
+
+    def build_step(name, params, render):
+        filepath = build.completed(name, params)
+        if filepath is not None:
+            cache.touch(filepath)
+            return filepath
+        filepath = render()
+        build.complete(name, filepath, params)
+        return filepath
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            title_card = executor.submit(
+                build_step, "title_card", title_card_params,
+                lambda: render_title_card(cache, title, subtitle, (width, height), duration=3, font_size=48, subtitle_font_size=30, threads=threads, profile=profile, output_options=title_card_options),
+            )
+            futures = {
+                executor.submit(
+                    build_step, f"segment_{index}", segment_params[index],
+                    lambda video=video, segment=segment: render_segment(video, segment, cache, threads, stream_parameters and stream_parameters[video.mp4_filename], profile=profile),
+                ): index
+                for index, (video, segment) in enumerate(segments)
+            }
+            for completed, future in enumerate(as_completed(futures), start=1):
+                index = futures[future]
+                faded_segments[index] = future.result()
+                print(f"Processed segment {completed}/{total_segments}: {faded_segments[index]}")
+                report("segment", completed, total_segments, index)
+            title_card_filepath = title_card.result()
+            report("title_card", 1, 1)
+    finally:
+        cache.save()
+
+    inputs = [title_card_filepath] + faded_segments
+    merge_params = {"inputs": [[os.path.basename(filepath), os.path.getsize(filepath)] for filepath in inputs]}
+    if build.completed("merge", merge_params) is None:
+        with atomic_output(output_path) as tmp_path:
+            if stream_parameters is not None:
+                concat_videos(inputs, tmp_path)
+            else:
+                merge_videos(inputs, tmp_path, threads=threads, profile=profile)
+        build.complete("merge", output_path, merge_params)
+    else:
+        print(f"{output_path} is already merged from these segments")
+    report("merge", 1, 1)
+
+    cache.evict(keep_since=started_at)
+    cache.save()
+    cache_report = cache.report()
+    print(f"Render cache: {cache_report['hits']} hits, {cache_report['misses']} misses, {cache_report['size_bytes'] / 1024 ** 2:.0f} MB")
+    report("cache", cache_report["hits"], cache_report["hits"] + cache_report["misses"])
+    return output_path
 
 if __name__ == "__main__":
     projects = get_all_projects()
@@ -0,0 +1,143 @@
+import atexit
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import ffmpeg
+
+from instrumentation import span
+
+METADATA_INDEX_FILEPATH = "metadata_cache.json"
+PROBE_WORKERS = int(os.environ.get("PROBE_WORKERS", 8))
+
+
+class MetadataIndex:
+    """
+    Persistent index of ffprobe results, keyed on file path and invalidated
+    when the file's size or mtime changes.
+    """
+
+    def __init__(self, filepath=METADATA_INDEX_FILEPATH):
+        self.filepath = filepath
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @property
+    def entries(self) -> dict:
+        if self._entries is None:
+            try:
+                with open(self.filepath, "r") as f:
+                    self._entries = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._entries = {}
+        return self._entries
+
+    def lookup(self, filepath) -> Optional[tuple[int, float]]:
+        """
+        Return the cached (size_bytes, duration) for a file, or None if missing or stale.
+
+        Files that failed to probe are cached as (0, 0) until they change, e.g. once a
+        partial copy finishes.
+        """
+        entry = self.entries.get(filepath)
+        # Entries from the old [size, duration] format have no mtime and are treated as stale
+        if not isinstance(entry, dict):
+            return None
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            return None
+        if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+            return None
+        if "error" in entry:
+            return 0, 0
+        return entry["size"], entry["duration"]
+
+    def probe(self, filepath) -> tuple[int, float]:
+        """
+        Run ffprobe on a file and record the result, or the failure. Does not save the index.
+        """
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError as e:
+            print(f"Error getting metadata for {filepath}: {e}")
+            return 0, 0
+        try:
+            with span("probe", os.path.basename(filepath)):
+                probe = ffmpeg.probe(filepath)
+            video_stream = next(
+                (stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None
+            )
+            if video_stream is None:
+                raise ValueError("No video stream found in file")
+            duration = float(video_stream['duration'])
+        except Exception as e:
+            print(f"Error getting metadata for {filepath}: {e}")
+            with self._lock:
+                self.entries[filepath] = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                    "error": str(e),
+                }
+                self._dirty = True
+            return 0, 0
+
+        with self._lock:
+            self.entries[filepath] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "duration": duration,
+            }
+            self._dirty = True
+        return stat.st_size, duration
+
+    def get(self, filepath) -> tuple[int, float]:
+        cached = self.lookup(filepath)
+        if cached is not None:
+            return cached
+        return self.probe(filepath)
+
+    def get_many(self, filepaths, max_workers=PROBE_WORKERS) -> dict[str, tuple[int, float]]:
+        """
+        Get metadata for many files, probing stale entries concurrently and
+        saving the index once at the end.
+        """
+        results = {}
+        stale = []
+        for filepath in filepaths:
+            cached = self.lookup(filepath)
+            if cached is None:
+                stale.append(filepath)
+            else:
+                results[filepath] = cached
+
+        if stale:
+            print(f"Probing {len(stale)} of {len(results) + len(stale)} files with {max_workers} workers")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for filepath, metadata in zip(stale, executor.map(self.probe, stale)):
+                    results[filepath] = metadata
+            self.save()
+
+        return results
+
+    def save(self):
+        """
+        Atomically write the index, if anything changed since the last save.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            # Render and ingest worker processes save the index too
+            directory, filename = os.path.split(self.filepath)
+            tmp_filepath = os.path.join(directory, f".{filename}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_filepath, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_filepath, self.filepath)
+            self._dirty = False
+
+
+METADATA_INDEX = MetadataIndex()
+atexit.register(METADATA_INDEX.save)
@@ -1,12 +1,23 @@
 import atexit
-import json
 import os
 from typing import Optional
-import ffmpeg
 import numpy as np
-from pydantic import BaseModel
-
-from telemetry import get_telemetry
+from pydantic import BaseModel, PrivateAttr
+
+from metadata_index import METADATA_INDEX
+from interest import (
+    BUCKET_MEAN,
+    BUCKET_START,
+    SUGGESTED_SEGMENT_THRESHOLD,
+    compute_interest,
+    downsample_interest,
+    extract_interesting_segments,
+    load_interest_pyramid,
+)
+from instrumentation import span
+from orientation import load_orientation_track
+from segment_store import SEGMENT_STORE
+from telemetry import load_telemetry, sidecar_path
 
 
 def get_filenames(filenames, ext):
@@ -14,56 +25,88 @@ def get_filenames(filenames, ext):
     return options
 
 
+def get_uid(mp4_filename):
+    return mp4_filename.replace(".MP4", "").replace("GX", "")
+
+
+# Sidecar kinds, with their extensions in order of preference
+SIDECAR_EXTENSIONS = {
+    "lrv": [".lrv"],
+    "thumbnail": [".thm"],
+    "accel": [".accel.npy", ".accel.json"],
+    "gyro": [".gyro.npy", ".gyro.json"],
+    "segments": [".segments.json"],
+}
+
+
+def get_sidecar_uids(filename) -> set[str]:
+    """
+    The uids a file can belong to: its name up to the first dot, with and without the
+    GoPro prefix (GX, GL, GH...), e.g. GL010180.LRV -> {"GL010180", "010180"}.
+    """
+    stem = filename.split(".", 1)[0]
+    uids = {stem}
+    if len(stem) > 2 and stem[0] == "G" and stem[1].isalpha():
+        uids.add(stem[2:])
+    return uids
+
+
+def index_sidecars(filenames) -> dict[str, dict[str, str]]:
+    """
+    Index a directory's sidecar files by uid and kind, in one pass over the filenames.
+
+    Returns:
+        dict: {uid: {kind: filename}}, with the preferred extension of each kind.
+    """
+    index: dict[str, dict[str, tuple[int, str]]] = {}
+    for filename in filenames:
+        lower = filename.lower()
+        for kind, extensions in SIDECAR_EXTENSIONS.items():
+            rank = next((rank for rank, ext in enumerate(extensions) if lower.endswith(ext)), None)
+            if rank is None:
+                continue
+            for uid in get_sidecar_uids(filename):
+                current = index.setdefault(uid, {}).get(kind)
+                if current is None or rank < current[0]:
+                    index[uid][kind] = (rank, filename)
+    return {uid: {kind: filename for kind, (_, filename) in kinds.items()} for uid, kinds in index.items()}
+
+
 class Segment(BaseModel):
     start_time: float
     end_time: float
 
-    def filepath(self, video: "Video"):
-        filename = f"{video.mp4_filename.replace('.MP4', '')}_segment_{int(self.start_time)}_{int(self.end_time)}.mp4"
-        return os.path.join("./projects", video.project_dir_name, "segments", filename)
-
-
 
 class InterestLevel(BaseModel):
     timestamp: float
     interest_level: float
 
 
-_CACHED_METADATA = None
-def get_metadata(project_name, filename):
-    global _CACHED_METADATA
-    if _CACHED_METADATA is None:
-        try:
-            with open("metadata_cache.json", "r") as f:
-                _CACHED_METADATA = json.load(f)
-        except FileNotFoundError:
-            _CACHED_METADATA = {}
-
-    filepath = os.path.join("./projects/", project_name, filename)
-    if filepath in _CACHED_METADATA:
-        return _CACHED_METADATA[filepath]
-
-    try:
-        probe = ffmpeg.probe(filepath)
-        video_stream = next(
-            (stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None
-        )
-        if video_stream is None:
-            raise ValueError("No video stream found in file")
-
-        duration = float(video_stream['duration'])
-        size_bytes = os.path.getsize(filepath)
-        _CACHED_METADATA[filepath] = (size_bytes, duration)
+class SegmentDiff(BaseModel):
+    """
+    An edit to the segments of one video.
+    """
+    video_slug: str
+    segments: Optional[list[Segment]] = None
+    remove: list[Segment] = []
+    add: list[Segment] = []
 
-        with open("metadata_cache.json", "w") as f:
-            json.dump(_CACHED_METADATA, f)
 
-        return size_bytes, duration
-    except Exception as e:
-        print(f"Error getting metadata: {e}")
-        return 0, 0
+class InterestSeries(BaseModel):
+    """
+    Downsampled interest levels of a video, one entry per bucket in each list.
+    """
+    resolution: float
+    timestamps: list[float]
+    min: list[float]
+    max: list[float]
+    mean: list[float]
 
 
+def get_metadata(project_name, filename):
+    # Saved in batches by METADATA_INDEX.get_many, and at exit, not once per video
+    filepath = os.path.join("./projects/", project_name, filename)
+    return METADATA_INDEX.get(filepath)
 
 
 class Video(BaseModel):
@@ -80,45 +123,95 @@ class Video(BaseModel):
     suggested_segments: Optional[list[Segment]] = None
     interest_levels: Optional[list[InterestLevel]] = None
 
-    accel: list[dict] = []
-    gyro: list[dict] = []
     segments: list[Segment] = []
 
-    @classmethod
-    def from_mp4(cls, project_dir_name, mp4_filename, filenames):
-
-        lrv_filenames = get_filenames(filenames, ".lrv")
-        thumbnail_filenames = get_filenames(filenames, ".thm")
-        accel_filenames = get_filenames(filenames, ".accel.json")
-        gyro_filenames = get_filenames(filenames, ".gyro.json")
-        segments_filenames = get_filenames(filenames, ".segments.json")
+    _accel: Optional[np.ndarray] = PrivateAttr(default=None)
+    _gyro: Optional[np.ndarray] = PrivateAttr(default=None)
+    _orientation: dict = PrivateAttr(default_factory=dict)
+    _interest_pyramid: Optional[np.ndarray] = PrivateAttr(default=None)
 
+    @property
+    def accel(self) -> np.ndarray:
+        if self._accel is None:
+            self.calculate_telemetry()
+        return self._accel
 
-        def get_filename_from_uid(uid, filenames):
-            for filename in filenames:
-                if uid in filename:
-                    return filename
-            return None
+    @property
+    def gyro(self) -> np.ndarray:
+        if self._gyro is None:
+            self.calculate_telemetry()
+        return self._gyro
+
+    def filepath(self, draft=False) -> str:
+        """
+        Path of the video to render or analyse from. Drafts use the low resolution LRV
+        proxy when there is one, and the full resolution MP4 otherwise.
+        """
+        filename = self.lrv_filename if draft and self.lrv_filename is not None else self.mp4_filename
+        return os.path.join("./projects", self.project_dir_name, filename)
+
+    def orientation(self, fps, alpha=0.98) -> np.ndarray:
+        """
+        Roll/pitch/yaw of the camera at every frame, computed once per video and cached on disk.
+
+        Args:
+            fps: Frame rate of the video.
+            alpha: Complementary filter weight of the gyro.
+
+        Returns:
+            Memory-mapped (frames, 4) timestamp/roll/pitch/yaw array.
+        """
+        key = (fps, alpha)
+        if key not in self._orientation:
+            filepath = os.path.join("./projects", self.project_dir_name, self.mp4_filename)
+            self._orientation[key] = load_orientation_track(filepath, fps, self.length, alpha)
+        return self._orientation[key]
+
+    def interest_pyramid(self) -> np.ndarray:
+        """
+        Per-second, per-10s and per-minute min/max/mean interest, computed once per video
+        and cached on disk.
+
+        Returns:
+            Memory-mapped (buckets, 6) resolution/start/min/max/mean/count array.
+        """
+        if self._interest_pyramid is None:
+            filepath = os.path.join("./projects", self.project_dir_name, self.mp4_filename)
+            self._interest_pyramid = load_interest_pyramid(filepath)
+        return self._interest_pyramid
 
-        uid = mp4_filename.replace(".MP4", "").replace("GX", "")
-        lrv_filename = get_filename_from_uid(uid, lrv_filenames)
-        thumbnail_filename = get_filename_from_uid(uid, thumbnail_filenames)
-        accel_filename = get_filename_from_uid(uid, accel_filenames)
-        gyro_filename = get_filename_from_uid(uid, gyro_filenames)
-        segments_filename = get_filename_from_uid(uid, segments_filenames)
+    @classmethod
+    def from_mp4(cls, project_dir_name, mp4_filename, filenames, metadata=None, sidecars=None):
+        """
+        Build a Video from an MP4 and the sidecar files next to it.
+
+        Args:
+            filenames: Names of the files in the project directory.
+            sidecars: index_sidecars(filenames), if already built for the directory.
+        """
+        if sidecars is None:
+            sidecars = index_sidecars(filenames)
+
+        uid = get_uid(mp4_filename)
+        video_sidecars = sidecars.get(uid, {})
+        lrv_filename = video_sidecars.get("lrv")
+        thumbnail_filename = video_sidecars.get("thumbnail")
+        accel_filename = video_sidecars.get("accel")
+        gyro_filename = video_sidecars.get("gyro")
+        segments_filename = video_sidecars.get("segments")
 
         segments = []
         interest_levels = []
         if segments_filename is not None:
             segments_filepath = os.path.join("./projects/", os.path.join(project_dir_name, segments_filename))
 
-            with open(segments_filepath, "r") as f:
-                content = f.read()
-                if content:
-                    segments_json = json.loads(content)
-                    segments = [Segment(**segment) for segment in segments_json["segments"]]
-                    interest_levels = [InterestLevel(**segment) for segment in segments_json.get("interest_levels", [])]
-        size_bytes, duration = get_metadata(project_dir_name, mp4_filename)
+            segments_json = SEGMENT_STORE.read(segments_filepath)
+            if segments_json:
+                segments = [Segment(**segment) for segment in segments_json["segments"]]
+                interest_levels = [InterestLevel(**segment) for segment in segments_json.get("interest_levels", [])]
+        if metadata is None:
+            metadata = get_metadata(project_dir_name, mp4_filename)
+        size_bytes, duration = metadata
 
         video = Video(
             project_dir_name=project_dir_name,
@@ -141,197 +234,84 @@ class Video(BaseModel):
         return video
 
     def calculate_telemetry(self):
-        if self.accel_filename is None:
-            self.accel_filename = self.mp4_filename.replace(".MP4", ".accel.json")
-        if self.gyro_filename is None:
-            self.gyro_filename = self.mp4_filename.replace(".MP4", ".gyro.json")
-        accel_filepath = os.path.join("./projects/", os.path.join(self.project_dir_name, self.accel_filename))
-        gyro_filepath = os.path.join("./projects/", os.path.join(self.project_dir_name, self.gyro_filename))
-
-        self.accel = []
-        if os.path.exists(accel_filepath):
-            with open(accel_filepath, "r") as f:
-                content = f.read()
-                if content:
-                    self.accel = json.loads(content)
-
-        self.gyro = []
-        if os.path.exists(gyro_filepath):
-            with open(gyro_filepath, "r") as f:
-                content = f.read()
-                if content:
-                    self.gyro = json.loads(content)
-
-        if len(self.accel) == 0:
-            filepath = os.path.join("./projects", self.project_dir_name, self.mp4_filename)
-            telemetry = get_telemetry(filepath)
-            self.accel = telemetry.accel
-            self.gyro = telemetry.gyro
-
-            with open(accel_filepath, "w") as f:
-                f.write(json.dumps(telemetry.accel, indent=4))
-
-            with open(gyro_filepath, "w") as f:
-                f.write(json.dumps(telemetry.gyro, indent=4))
+        filepath = os.path.join("./projects", self.project_dir_name, self.mp4_filename)
+        telemetry = load_telemetry(filepath)
+        self._accel = telemetry.accel
+        self._gyro = telemetry.gyro
+        self.accel_filename = os.path.basename(sidecar_path(self.mp4_filename, "accel"))
+        self.gyro_filename = os.path.basename(sidecar_path(self.mp4_filename, "gyro"))
 
     def shrink_interest_levels_resolution(self):
-        if type(self.interest_levels[0].timestamp == int):
+        """
+        Average the interest levels per second, unless they already are.
+        """
+        if not self.interest_levels or all(float(p.timestamp).is_integer() for p in self.interest_levels):
             return
 
-        values = {}
-        for datapoint in self.interest_levels:
-            timestamp = int(datapoint.timestamp)
-            if timestamp not in values:
-                values[timestamp] = []
-            values[timestamp].append(datapoint.interest_level)
-
+        timestamps = np.array([p.timestamp for p in self.interest_levels])
+        values = np.array([p.interest_level for p in self.interest_levels])
+        order = np.argsort(timestamps, kind="stable")
+        rows = downsample_interest(timestamps[order], values[order], 1)
         self.interest_levels = [
-            InterestLevel(timestamp=timestamp, interest_level=float(np.mean(values[timestamp])))
-            for timestamp in values
+            InterestLevel(timestamp=timestamp, interest_level=interest_level)
+            for timestamp, interest_level in zip(rows[:, BUCKET_START].tolist(), rows[:, BUCKET_MEAN].tolist())
         ]
 
     def calculate_suggested_segments(self):
         if self.segments_filename is None:
             self.segments_filename = self.mp4_filename.replace(".MP4", ".segments.json")
         filepath = os.path.join("./projects/", os.path.join(self.project_dir_name, self.segments_filename))
-        if os.path.exists(filepath):
-            with open(filepath, "r") as f:
-                content = f.read()
-                if content:
-                    segments_json = json.loads(content)
-                    self.segments = [Segment(**segment) for segment in segments_json["segments"]]
-                    self.suggested_segments = self.segments
-                    self.interest_levels = [InterestLevel(**segment) for segment in segments_json.get("interest_levels", [])]
-                    return
+        segments_json = SEGMENT_STORE.read(filepath)
+        if segments_json:
+            self.segments = [Segment(**segment) for segment in segments_json["segments"]]
+            self.suggested_segments = self.segments
+            self.interest_levels = [InterestLevel(**segment) for segment in segments_json.get("interest_levels", [])]
+            return
 
         if len(self.interest_levels) == 0:
 
             self.calculate_telemetry()
 
-            interest_levels = {}
-            for datapoint in self.accel:
-                timestamp = datapoint["timestamp"]
-                if timestamp not in interest_levels:
-                    interest = datapoint["x"] + datapoint["y"] + datapoint["z"]
-                    interest_levels[timestamp] = interest
-            for datapoint in self.gyro:
-                timestamp = datapoint["timestamp"]
-                if timestamp not in interest_levels:
-                    interest = datapoint["x"] + datapoint["y"] + datapoint["z"]
-                    interest_levels[timestamp] = interest
-
-            def extract_interesting_segments(
-                    data: dict,
-                    threshold: float,
-                    minimum_length: float = 1,
-                    buffer: float = 0.5,
-                    merge_distance: float = 3
-            ):
-                """
-                Extracts interesting segments from timestamped interest level data.
-
-                Args:
-                    data: Dict of {timestamp: interest_level}.
-                    threshold: Interest level threshold to consider a point interesting.
-                    minimum_length: Minimum length of segment to include.
-                    buffer: Time to add before start and after end of each segment.
-                    merge_distance: Merge segments if gap between them is less than this.
-
-                Returns:
-                    List of dicts with 'start' and 'end' keys.
-                """
-                if not data:
-                    return []
-
-                segments = []
-                sorted_times = sorted(data.keys())
-                current_start = None
-
-                for t in sorted_times:
-                    interest = data[t]
-
-                    if interest >= threshold:
-                        if current_start is None:
-                            current_start = t
-                    else:
-                        if current_start is not None:
-                            if t - current_start >= minimum_length:
-                                segments.append({
-                                    "start": current_start - buffer,
-                                    "end": t + buffer
-                                })
-                            current_start = None
-
-                if current_start is not None:
-                    end_time = sorted_times[-1]
-                    if end_time - current_start >= minimum_length:
-                        segments.append({
-                            "start": current_start - buffer,
-                            "end": end_time + buffer
-                        })
-
-                # Merge segments that are close together
-                if not segments:
-                    return []
-
-                merged_segments = [
-                    Segment(start_time=segments[0]["start"], end_time=segments[0]["end"])
+            with span("interest", self.mp4_filename, profile=True):
+                timestamps, interest = compute_interest(self.accel, self.gyro)
+                segments = [
+                    Segment(start_time=start, end_time=end)
+                    for start, end in extract_interesting_segments(timestamps, interest, SUGGESTED_SEGMENT_THRESHOLD)
                 ]
-
-                for seg in segments[1:]:
-                    last = merged_segments[-1]
-                    if seg["start"] - last.end_time <= merge_distance:
-                        last.end_time = max(last.end_time, seg["end"])
-                    else:
-                        merged_segments.append(Segment(start_time=seg["start"], end_time=seg["end"]))
-
-                return merged_segments
-
-            def smooth_interest(data: dict, window_size: int = 5) -> dict:
-                """
-                Smooth interest levels using a simple moving average.
-
-                Args:
-                    data: Dict of {timestamp: interest_level}.
-                    window_size: Number of points in the moving average window.
-
-                Returns:
-                    Dict of {timestamp: smoothed_interest_level}.
-                """
-                if not data:
-                    return {}
-
-                sorted_items = sorted(data.items())
-                timestamps = [t for t, _ in sorted_items]
-                values = [v for _, v in sorted_items]
-
-                smoothed_values = np.convolve(values, np.ones(window_size) / window_size, mode='same')
-
-                return dict(zip(timestamps, smoothed_values))
-
-            interest_levels = smooth_interest(interest_levels, window_size=300)
-            segments = extract_interesting_segments(interest_levels, 10)
             self.suggested_segments = segments
             self.interest_levels = [
-                InterestLevel(timestamp=timestamp, interest_level=interest)
-                for timestamp, interest in interest_levels.items()
+                InterestLevel(timestamp=timestamp, interest_level=interest_level)
+                for timestamp, interest_level in zip(timestamps.tolist(), interest.tolist())
             ]
             self.segments = segments
 
         self.shrink_interest_levels_resolution()
 
     def write_segments(self):
+        """
+        Save the segments to the .segments.json sidecar, in the background.
+
+        Only the segments are written. Interest levels are derived from the telemetry
+        and cached in their own sidecar, see interest_pyramid.
+        """
         if self.segments_filename is None:
-                raise ValueError("No segments filename provided")
+            self.segments_filename = self.mp4_filename.replace(".MP4", ".segments.json")
 
         segments_filepath = os.path.join("./projects/", self.project_dir_name, self.segments_filename)
-        with open(segments_filepath, "w") as f:
-            segments_json = {
-                "segments": [json.loads(segment.model_dump_json()) for segment in self.segments],
-                "interest_levels": [json.loads(interest_level.model_dump_json()) for interest_level in self.interest_levels],
-            }
-            f.write(json.dumps(segments_json, indent=4))
-        print(f"Wrote {len(self.segments)} segments to", segments_filepath)
+        SEGMENT_STORE.write(segments_filepath, {
+            "segments": [segment.model_dump() for segment in self.segments],
+        })
+
+    def apply_segment_diff(self, diff: "SegmentDiff"):
+        """
+        Apply an edit to the segments, without re-running the analysis.
+
+        Replaces the segments if the diff has `segments`, then removes the segments in
+        `remove` and adds the ones in `add`. Segments stay sorted by start time.
+        """
+        segments = self.segments if diff.segments is None else diff.segments
+        segments = [segment for segment in segments if segment not in diff.remove] + diff.add
+        self.segments = sorted(segments, key=lambda segment: (segment.start_time, segment.end_time))
 
 
 class Project(BaseModel):
@@ -340,35 +320,33 @@ class Project(BaseModel):
     videos: list[Video]
 
 
+class VideoSummary(BaseModel):
+    """
+    What listings need to know about a Video, without its interest levels or telemetry.
+    """
+    project_dir_name: str
+    length: float
+    size_bytes: int
+    slug: str
+    mp4_filename: str
+    lrv_filename: Optional[str]
+    thumbnail_filename: Optional[str]
+    segments: list[Segment] = []
+
+    @classmethod
+    def from_video(cls, video: Video) -> "VideoSummary":
+        return cls(**{name: getattr(video, name) for name in cls.model_fields})
 
-CACHED_PROJECTS = None
-def get_all_projects():
-    global CACHED_PROJECTS
-    if CACHED_PROJECTS is not None:
-        return CACHED_PROJECTS
-
-    projects = []
-    for project_name in os.listdir("projects"):
-        if os.path.isdir(os.path.join("projects", project_name)):
-            filenames = os.listdir(os.path.join("projects", project_name))
-            mp4_filenames = get_filenames(filenames, ".mp4")
-            project = Project(
-                name=project_name,
-                slug=project_name.replace(" ", "_").lower(),
-                videos=[],
-            )
-            for mp4_filename in mp4_filenames:
-                video = Video.from_mp4(project_name, mp4_filename, filenames)
-                # if len(video.segments) == 0:
-                #     video.calculate_telemetry()
-                project.videos.append(video)
-            projects.append(project)
-
-    CACHED_PROJECTS = projects
-    return projects
-
-def get_project(project_slug):
-    projects = get_all_projects()
-    for project in projects:
-        if project.slug == project_slug:
-            return project
+
+class ProjectSummary(BaseModel):
+    name: str
+    slug: str
+    videos: list[VideoSummary]
+
+    @classmethod
+    def from_project(cls, project: Project) -> "ProjectSummary":
+        return cls(
+            name=project.name,
+            slug=project.slug,
+            videos=[VideoSummary.from_video(video) for video in project.videos],
+        )
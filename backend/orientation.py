@@ -0,0 +1,175 @@
+import os
+
+import numpy as np
+from scipy.signal import lfilter
+
+from telemetry import TIMESTAMP, X, Y, Z, load_stream, load_telemetry, save_stream, sidecar_path
+
+# Column layout of an orientation track: one float64 row per video frame, angles in degrees.
+ROLL, PITCH, YAW = 1, 2, 3
+ORIENTATION_COLUMNS = ("timestamp", "roll", "pitch", "yaw")
+
+
+def integrate_gyro(timestamps, rates) -> np.ndarray:
+    """
+    Integrate angular rates into angles, starting at 0.
+
+    Parameters:
+        timestamps (np.ndarray): (N,) sample times in seconds.
+        rates (np.ndarray): (N,) angular rates, in units per second.
+
+    Returns:
+        np.ndarray: (N,) angles, angle[i] = angle[i - 1] + rates[i] * (t[i] - t[i - 1]).
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    rates = np.asarray(rates, dtype=np.float64)
+    angles = np.zeros(len(rates))
+    np.cumsum(rates[1:] * np.diff(timestamps), out=angles[1:])
+    return angles
+
+
+def accel_roll(accel) -> np.ndarray:
+    """
+    Roll in degrees implied by gravity, from (N, 4) timestamp/x/y/z accel samples.
+    """
+    return np.degrees(np.arctan2(accel[:, Y], accel[:, Z]))
+
+
+def accel_pitch(accel) -> np.ndarray:
+    """
+    Pitch in degrees implied by gravity, from (N, 4) timestamp/x/y/z accel samples.
+    """
+    return np.degrees(np.arctan2(-accel[:, X], np.hypot(accel[:, Y], accel[:, Z])))
+
+
+def complementary_filter(timestamps, rates, angles, alpha) -> np.ndarray:
+    """
+    Fuse integrated gyro rates with an absolute angle estimate (e.g. from the accelerometer).
+
+    Equivalent to the recurrence
+        fused[0] = angles[0]
+        fused[i] = alpha * (fused[i - 1] + rates[i] * dt[i]) + (1 - alpha) * angles[i]
+    run as a first order IIR filter with lfilter, so it's a single pass in C.
+
+    Parameters:
+        timestamps (np.ndarray): (N,) sample times in seconds.
+        rates (np.ndarray): (N,) angular rates, in angle units per second.
+        angles (np.ndarray): (N,) absolute angle estimates.
+        alpha (float): Weight of the gyro, 0 to use only `angles` and 1 to only integrate the gyro.
+
+    Returns:
+        np.ndarray: (N,) fused angles.
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    if len(angles) == 0:
+        return angles.copy()
+    dt = np.gradient(np.asarray(timestamps, dtype=np.float64)) if len(angles) > 1 else np.zeros(1)
+    inputs = alpha * np.asarray(rates, dtype=np.float64) * dt + (1 - alpha) * angles
+    inputs[0] = angles[0]
+    return lfilter([1.0], [1.0, -alpha], inputs)
+
+
+def estimate_roll(gyro, accel=None, alpha=0.98, axis=X, start_time=None, end_time=None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Estimate camera roll from (N, 4) timestamp/x/y/z telemetry arrays.
+
+    With accel, the gyro rate around `axis` is fused with the accelerometer's roll by
+    complementary_filter. Without it, the gyro rate is just integrated from 0.
+
+    Parameters:
+        gyro (np.ndarray): Gyro samples.
+        accel (np.ndarray): Accel samples, or None to integrate the gyro only.
+        alpha (float): Complementary filter weight of the gyro.
+        axis (int): Gyro column to use as the roll rate.
+        start_time (float): If given, only use samples at or after this time.
+        end_time (float): If given, only use samples at or before this time.
+
+    Returns:
+        (timestamps, roll): (N,) gyro sample times and the roll at each of them.
+    """
+    streams = [gyro] if accel is None else [gyro, accel]
+    if start_time is not None or end_time is not None:
+        lower = -np.inf if start_time is None else start_time
+        upper = np.inf if end_time is None else end_time
+        streams = [s[(s[:, TIMESTAMP] >= lower) & (s[:, TIMESTAMP] <= upper)] for s in streams]
+
+    # Accel and gyro run at about the same rate, so pair samples up by index
+    length = min(len(s) for s in streams)
+    streams = [s[:length] for s in streams]
+    timestamps = np.array(streams[0][:, TIMESTAMP])
+    rates = streams[0][:, axis]
+
+    if accel is None:
+        return timestamps, integrate_gyro(timestamps, rates)
+    return timestamps, complementary_filter(timestamps, rates, accel_roll(streams[1]), alpha)
+
+
+def compute_orientation_track(gyro, accel, frame_timestamps, alpha=0.98) -> np.ndarray:
+    """
+    Estimate roll/pitch/yaw over a whole video and resample them to its frame timestamps.
+
+    Roll and pitch fuse the gyro with the accelerometer's gravity vector. Yaw has no
+    absolute reference, so it is the integrated gyro, relative to the first sample.
+
+    Returns:
+        np.ndarray: (frames, 4) timestamp/roll/pitch/yaw rows.
+    """
+    timestamps, roll = estimate_roll(gyro, accel, alpha=alpha, axis=X)
+    length = len(timestamps)
+    pitch = complementary_filter(timestamps, gyro[:length, Y], accel_pitch(accel[:length]), alpha)
+    yaw = integrate_gyro(timestamps, gyro[:length, Z])
+
+    track = np.empty((len(frame_timestamps), len(ORIENTATION_COLUMNS)), dtype=np.float64)
+    track[:, TIMESTAMP] = frame_timestamps
+    for column, angles in ((ROLL, roll), (PITCH, pitch), (YAW, yaw)):
+        track[:, column] = np.interp(frame_timestamps, timestamps, angles) if length else np.nan
+    return track
+
+
+def orientation_track_path(filepath, fps, alpha):
+    """
+    Path of the cached orientation track for a video, e.g. GX010180.orientation_59.94fps_0.98.npy
+    """
+    return sidecar_path(filepath, f"orientation_{fps:g}fps_{alpha:g}")
+
+
+def load_orientation_track(filepath, fps, duration, alpha=0.98) -> np.ndarray:
+    """
+    Load a video's orientation track, computing and caching it next to the video on first use.
+
+    The cache is rebuilt if the video's gyro telemetry sidecar is newer than it.
+
+    Args:
+        filepath: Path to the MP4 file.
+        fps: Frame rate to sample the track at.
+        duration: Length of the video in seconds.
+        alpha: Complementary filter weight of the gyro.
+
+    Returns:
+        Memory-mapped (frames, 4) timestamp/roll/pitch/yaw array.
+    """
+    track_filepath = orientation_track_path(filepath, fps, alpha)
+    try:
+        track_mtime = os.path.getmtime(track_filepath)
+        telemetry_mtime = os.path.getmtime(sidecar_path(filepath, "gyro"))
+        if track_mtime >= telemetry_mtime:
+            return load_stream(track_filepath)
+    except FileNotFoundError:
+        pass
+
+    telemetry = load_telemetry(filepath)
+    frame_timestamps = np.arange(int(round(duration * fps))) / fps
+    save_stream(track_filepath, compute_orientation_track(telemetry.gyro, telemetry.accel, frame_timestamps, alpha))
+    print(f"Cached orientation track for {filepath} at {fps:g} fps")
+    return load_stream(track_filepath)
+
+
+def slice_track(track, start_time, end_time) -> np.ndarray:
+    """
+    Rows of a track (or any array with a sorted timestamp column) between start_time and
+    end_time inclusive, found by binary search. Returns a view.
+    """
+    timestamps = track[:, TIMESTAMP]
+    start = np.searchsorted(timestamps, start_time, side="left")
+    end = np.searchsorted(timestamps, end_time, side="right")
+    return track[start:end]
@@ -1,43 +1,34 @@
 import asyncio
 import os
-import subprocess
 from typing import List
 
 import cv2
 import numpy as np
 from scipy.signal import savgol_filter
 
+from frame_pipeline import warp_video
+from instrumentation import run_ffmpeg, span
 from models import Video, Segment  # Replace with your actual models
-from telemetry import get_telemetry
+from orientation import estimate_roll
+from render_cache import atomic_output
+from telemetry import load_telemetry
 
 
-def generate_segment_filename(video: Video, segment: Segment) -> str:
+def generate_segment_filename(video: Video, segment: Segment, draft=False) -> str:
     base_name, ext = os.path.splitext(video.mp4_filename)
-    return f"{base_name}_segment_{int(segment.start_time)}_{int(segment.end_time)}{ext}"
+    suffix = "_draft" if draft else ""
+    return f"{base_name}_segment_{int(segment.start_time)}_{int(segment.end_time)}{suffix}{ext}"
 
 def compute_roll_angles_complementary(input_filepath, alpha=0.98):
-    telem = get_telemetry(input_filepath)
-    accel_data = telem.raw_accel_data
-    gyro_data = telem.raw_gyro_data
-    timestamps = telem.accel_timestamps
-    print(f"Accel: {len(accel_data)}, Gyro: {len(gyro_data)}, timestamps: {len(timestamps)}")
+    telem = load_telemetry(input_filepath)
+    timestamps, roll = estimate_roll(telem.gyro, telem.accel, alpha=alpha)
+    print(f"Accel: {len(telem.accel)}, Gyro: {len(telem.gyro)}, timestamps: {len(timestamps)}")
 
-    if len(accel_data) < 2:
-        raise ValueError(f"Not enough data for roll calculation. filepath:{input_filepath} Accel: {len(accel_data)}, Gyro: {len(gyro_data)}, timestamps: {len(timestamps)}")
+    if len(timestamps) < 2:
+        raise ValueError(f"Not enough data for roll calculation. filepath:{input_filepath} Accel: {len(telem.accel)}, Gyro: {len(telem.gyro)}, timestamps: {len(timestamps)}")
 
-    # Normalize timestamps to seconds
-    time_sec = (timestamps - timestamps[0]) / 1000.0
-    dt = np.gradient(time_sec)
-
-    # Compute roll from accel
-    accel_roll = np.degrees(np.arctan2(accel_data[:, 1], accel_data[:, 2]))
-
-    # Complementary filter to combine
-    roll = np.zeros_like(accel_roll)
-    roll[0] = accel_roll[0]
-    for i in range(1, len(roll)):
-        gyro_delta = gyro_data[i] * dt[i]  # assuming degrees/sec
-        roll[i] = alpha * (roll[i - 1] + gyro_delta) + (1 - alpha) * accel_roll[i]
+    # Telemetry timestamps are already in seconds
+    time_sec = timestamps - timestamps[0]
 
     # Interpolate to match video frame timestamps
     video_fps = 60
@@ -57,56 +48,41 @@ def compute_roll_angles_complementary(input_filepath, alpha=0.98):
     return smoothed
 
 
-def stabilize_video(input_path):
+def stabilize_video(input_path, profile=None):
     output_path = input_path.lower().replace(".mp4", "_stabilized.mp4")
 
-    roll_angles = compute_roll_angles_complementary(input_path)
-    cap = cv2.VideoCapture(input_path)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    w, h = int(cap.get(3)), int(cap.get(4))
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, fps, (w, h))
-
-    frame_id = 0
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret or frame_id >= len(roll_angles):
-            break
-
-        roll = roll_angles[frame_id]
-        M = cv2.getRotationMatrix2D((w / 2, h / 2), -roll, 1.0)
-        stabilized = cv2.warpAffine(frame, M, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
-
-        out.write(stabilized)
-        frame_id += 1
-
-    cap.release()
-    out.release()
+    with span("stabilize", os.path.basename(input_path), profile=True):
+        roll_angles = compute_roll_angles_complementary(input_path)
+        warp_video(input_path, output_path, -roll_angles, border_mode=cv2.BORDER_REFLECT, profile=profile)
 
     return output_path
 
 
-def extract_segment(video: Video, segment: Segment):
-    input_path = os.path.join("./projects", video.project_dir_name, video.mp4_filename)
-    output_filename = generate_segment_filename(video, segment)
+def extract_segment(video: Video, segment: Segment, draft=False):
+    # Drafts cut from the LRV proxy
+    input_path = video.filepath(draft)
+    output_filename = generate_segment_filename(video, segment, draft)
     output_path = os.path.join("./projects", video.project_dir_name, "segments",  output_filename)
 
+    # Written with atomic_output, so an existing file is never a partial one
     if os.path.exists(output_path):
         print(f"Skipping {output_filename}, already exists.")
         return output_path
 
     duration = segment.end_time - segment.start_time
-    command = [
-        "ffmpeg",
-        "-ss", str(segment.start_time),
-        "-i", input_path,
-        "-t", str(duration),
-        "-map", "0:0",  # video
-        "-c", "copy",
-        output_path
-    ]
-    print(f"Extracting segment {output_filename} from {input_path}: {' '.join(command)}")
-    subprocess.run(command)
+    with atomic_output(output_path) as tmp_path:
+        command = [
+            "ffmpeg",
+            "-ss", str(segment.start_time),
+            "-i", input_path,
+            "-t", str(duration),
+            "-map", "0:0",  # video
+            "-c", "copy",
+            tmp_path
+        ]
+        print(f"Extracting segment {output_filename} from {input_path}: {' '.join(command)}")
+        with span("extract", output_filename):
+            run_ffmpeg(command, "extract", tmp_path, quiet=False)
 
     return output_path
 
@@ -125,17 +101,18 @@ def join_segments(videos: List[Video], msg_queue: asyncio.Queue):
             for segment in segments:
                 f.write(f"file '{os.path.join("./projects", video.project_dir_name, "segments", segment)}'\n")
 
-        command = [
-            "ffmpeg",
-            "-f", "concat",
-            "-safe", "0",
-            "-i", "segments.txt",
-            "-c", "copy",
-            output_path
-        ]
-
         print(f"Joining segments into {output_filename}")
-        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        with atomic_output(output_path) as tmp_path:
+            command = [
+                "ffmpeg",
+                "-f", "concat",
+                "-safe", "0",
+                "-i", "segments.txt",
+                "-c", "copy",
+                tmp_path
+            ]
+            with span("merge", output_filename):
+                run_ffmpeg(command, "merge", tmp_path)
 
 def process_videos(videos: List[Video], msg_queue: asyncio.Queue):
     working_dir = os.path.join("./projects", videos[0].project_dir_name, "segments")
@@ -0,0 +1,281 @@
+import contextlib
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+from segment_store import write_json_atomic
+
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", 50 * 1024 ** 3))
+MANIFEST_FILENAME = "manifest.json"
+# Temporary file names of atomic_output
+TMP_OUTPUT_PATTERN = re.compile(r"^\..+\.(?P<pid>\d+)\.\d+\.tmp(\.[^.]*)?$")
+
+
+def is_intact(filepath, size) -> bool:
+    """
+    Whether a rendered file is still there at the size it was recorded with.
+    """
+    try:
+        return os.path.getsize(filepath) == size
+    except FileNotFoundError:
+        return False
+
+
+def source_identity(filepath):
+    """
+    Identity of a source file for cache keys: changes whenever the file does.
+    """
+    stat = os.stat(filepath)
+    return [os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns]
+
+
+@contextlib.contextmanager
+def atomic_output(output_path):
+    """
+    Yield a temporary path to render `output_path` to, and rename it into place only
+    once the render succeeds. A render that fails or is killed midway never leaves a
+    truncated file under the final name, so a file that exists is complete.
+
+    The temporary file is hidden, and keeps the extension ffmpeg picks the format from.
+    """
+    directory, filename = os.path.split(output_path)
+    base, ext = os.path.splitext(filename)
+    tmp_path = os.path.join(directory, f".{base}.{os.getpid()}.{threading.get_ident()}.tmp{ext}")
+    try:
+        yield tmp_path
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+
+
+def remove_orphaned_outputs(directory):
+    """
+    Remove the temporary files of atomic_output renders whose process died.
+    """
+    try:
+        filenames = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in filenames:
+        match = TMP_OUTPUT_PATTERN.match(filename)
+        if match is None:
+            continue
+        try:
+            os.kill(int(match.group("pid")), 0)
+        except ProcessLookupError:
+            print(f"Removing {filename}, left behind by an interrupted render")
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(directory, filename))
+        except PermissionError:
+            # Alive, but someone else's
+            pass
+
+
+class RenderCache:
+    """
+    Content-addressed cache of rendered files (segments, title cards) in a directory.
+
+    Outputs are named after a hash of the source files' identity and every parameter
+    that affects the render, so changing a cut time, fade or codec renders a new file
+    instead of reusing a stale one. A manifest records each entry's size and last use,
+    and the least recently used entries are evicted when the cache outgrows max_bytes.
+
+    Renders are written with atomic_output, and an entry is only reused if its file
+    still has the recorded size. Each entry is saved as soon as it is rendered, so a
+    build that is killed midway keeps the renders it finished.
+    """
+
+    def __init__(self, directory, max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = None
+        self._evicted = set()
+
+    @property
+    def entries(self) -> dict:
+        if self._entries is None:
+            try:
+                with open(self.manifest_path, "r") as f:
+                    self._entries = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._entries = {}
+        return self._entries
+
+    @staticmethod
+    def key(kind, sources, params) -> str:
+        """
+        Cache key for a render of `kind` from `sources` (file paths) with `params`.
+        """
+        identity = {
+            "kind": kind,
+            "sources": [source_identity(source) for source in sources],
+            "params": params,
+        }
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+    def get_or_render(self, kind, sources, params, ext, render):
+        """
+        Return the cached output for this render, calling render(output_path) on a miss.
+
+        Parameters:
+            kind (str): What is rendered, e.g. "segment" or "title_card".
+            sources (list of str): Input files the render reads.
+            params (dict): Every parameter that affects the output. Must be JSON serializable.
+            ext (str): Output file extension, e.g. ".mp4".
+            render (callable): Renders to the given path.
+
+        Returns:
+            str: Path to the rendered file.
+        """
+        key = self.key(kind, sources, params)
+        output_path = os.path.join(self.directory, f"{kind}_{key[:32]}{ext}")
+
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and is_intact(output_path, entry["size"]):
+                entry["last_used"] = time.time()
+                self.hits += 1
+                print(f"Render cache hit for {kind}: {output_path}")
+                return output_path
+
+        os.makedirs(self.directory, exist_ok=True)
+        with atomic_output(output_path) as tmp_path:
+            render(tmp_path)
+
+        with self._lock:
+            self.misses += 1
+            self.entries[key] = {
+                "filename": os.path.basename(output_path),
+                "kind": kind,
+                "params": params,
+                "size": os.path.getsize(output_path),
+                "last_used": time.time(),
+            }
+        self.save()
+        return output_path
+
+    def touch(self, filepath):
+        """
+        Count a render reused from outside the cache (e.g. from a build manifest) as a
+        hit, so it isn't evicted as unused.
+        """
+        filename = os.path.basename(filepath)
+        with self._lock:
+            for entry in self.entries.values():
+                if entry["filename"] == filename:
+                    entry["last_used"] = time.time()
+                    self.hits += 1
+                    return
+
+    def evict(self, keep_since=None):
+        """
+        Remove least recently used entries until the cache fits in max_bytes.
+
+        Parameters:
+            keep_since (float): Never evict entries used at or after this time, e.g. the
+                start of the current build.
+        """
+        with self._lock:
+            total = sum(entry["size"] for entry in self.entries.values())
+            for key, entry in sorted(self.entries.items(), key=lambda item: item[1]["last_used"]):
+                if total <= self.max_bytes:
+                    break
+                if keep_since is not None and entry["last_used"] >= keep_since:
+                    continue
+                try:
+                    os.remove(os.path.join(self.directory, entry["filename"]))
+                except FileNotFoundError:
+                    pass
+                total -= entry["size"]
+                del self.entries[key]
+                self._evicted.add(key)
+                print(f"Evicted {entry['filename']} from render cache")
+
+    def save(self):
+        """
+        Atomically write the manifest, keeping entries other caches on the same
+        directory (e.g. a concurrent preview render) added since we loaded it.
+        """
+        with self._lock:
+            try:
+                with open(self.manifest_path, "r") as f:
+                    on_disk = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                on_disk = {}
+            for key, entry in on_disk.items():
+                if key not in self.entries and key not in self._evicted:
+                    self.entries[key] = entry
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self.manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=4)
+            os.replace(tmp_path, self.manifest_path)
+
+    def report(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size_bytes": sum(entry["size"] for entry in self.entries.values()),
+        }
+
+
+class BuildManifest:
+    """
+    Journal of a build's completed steps, saved next to its output (e.g.
+    final_cut.build.json for final_cut.mp4) as each step completes.
+
+    A step only counts as done if it was recorded with the same parameters and its
+    file is still there at the recorded size. Restarting a build that died midway
+    redoes only the steps that didn't finish, and never trusts a truncated file. A
+    journal recorded with different build parameters is discarded.
+    """
+
+    def __init__(self, output_path, params):
+        self.directory = os.path.dirname(output_path)
+        self.path = f"{os.path.splitext(output_path)[0]}.build.json"
+        # Compare params as they come back from JSON, e.g. tuples as lists
+        self.params = json.loads(json.dumps(params))
+        self.steps = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("params") == self.params:
+                self.steps = data.get("steps", {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def completed(self, name, params=None) -> Optional[str]:
+        """
+        Path to the file a step produced, or None if it has to be redone.
+        """
+        step = self.steps.get(name)
+        if step is None or step["params"] != json.loads(json.dumps(params)):
+            return None
+        filepath = os.path.join(self.directory, step["filename"])
+        return filepath if is_intact(filepath, step["size"]) else None
+
+    def complete(self, name, filepath, params=None):
+        """
+        Record that a step produced `filepath`, which must already be complete.
+        """
+        with self._lock:
+            self.steps[name] = {
+                "filename": os.path.relpath(filepath, self.directory),
+                "size": os.path.getsize(filepath),
+                "params": json.loads(json.dumps(params)),
+                "completed_at": time.time(),
+            }
+            write_json_atomic(self.path, {"params": self.params, "steps": self.steps})
@@ -0,0 +1,114 @@
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+# Edits to a video's segments are written once they have been quiet for this long
+SEGMENTS_WRITE_DELAY = float(os.environ.get("SEGMENTS_WRITE_DELAY", 0.5))
+
+
+def write_json_atomic(filepath, content, overwrite=True) -> bool:
+    """
+    Write JSON to a file by writing a temporary file and renaming it over the original.
+
+    The temporary file is hidden (dot-prefixed) so the project catalog never mistakes it
+    for a sidecar. With overwrite=False, an existing file is left alone.
+
+    Returns:
+        bool: Whether the file was written.
+    """
+    directory, filename = os.path.split(filepath)
+    tmp_filepath = os.path.join(directory, f".{filename}.{os.getpid()}.tmp")
+    with open(tmp_filepath, "w") as f:
+        json.dump(content, f)
+    if overwrite:
+        os.replace(tmp_filepath, filepath)
+        return True
+    try:
+        # Unlike a rename, a link fails if the target exists
+        os.link(tmp_filepath, filepath)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp_filepath)
+
+
+class SegmentStore:
+    """
+    Persists edited segments to the .segments.json sidecars in a background thread.
+
+    Edits return immediately. Repeated edits to a file are coalesced, and only the
+    latest version is written, once no edits have come in for `delay` seconds. Reads
+    see pending edits before they reach the disk.
+    """
+
+    def __init__(self, delay=SEGMENTS_WRITE_DELAY):
+        self.delay = delay
+        self._pending: dict[str, dict] = {}
+        self._last_edit = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+
+    def read(self, filepath) -> Optional[dict]:
+        """
+        The content of a segments file, including pending edits, or None if it doesn't
+        exist or is empty.
+        """
+        with self._lock:
+            if filepath in self._pending:
+                return self._pending[filepath]
+        try:
+            with open(filepath, "r") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        return json.loads(content) if content else None
+
+    def write(self, filepath, content: dict):
+        """
+        Schedule a segments file to be replaced with `content`.
+        """
+        with self._lock:
+            self._pending[filepath] = content
+            self._last_edit = time.monotonic()
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="segment-store", daemon=True)
+                self._writer.start()
+        self._wake.set()
+
+    def flush(self):
+        """
+        Write all pending edits now.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = dict(self._pending)
+            for filepath, content in pending.items():
+                try:
+                    write_json_atomic(filepath, content)
+                    print(f"Wrote {len(content['segments'])} segments to", filepath)
+                except OSError as e:
+                    print(f"Error writing segments to {filepath}: {e}")
+                    continue
+                with self._lock:
+                    # Keep it pending if it was edited again while being written
+                    if self._pending.get(filepath) is content:
+                        del self._pending[filepath]
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            # Wait for a quiet period, so a burst of edits becomes one write per file
+            while (remaining := self._last_edit + self.delay - time.monotonic()) > 0:
+                time.sleep(remaining)
+            self.flush()
+
+
+SEGMENT_STORE = SegmentStore()
+atexit.register(SEGMENT_STORE.flush)
@@ -0,0 +1,252 @@
+import os
+import subprocess
+import tempfile
+
+import ffmpeg
+
+from instrumentation import run_ffmpeg, span
+
+# Encoder and Annex B bitstream filter for each source codec we can smart-render
+ENCODERS = {
+    "h264": ("libx264", "h264_mp4toannexb"),
+    "hevc": ("libx265", "hevc_mp4toannexb"),
+}
+
+# ffprobe profile name -> encoder -profile:v value
+PROFILES = {
+    ("h264", "Constrained Baseline"): "baseline",
+    ("h264", "Baseline"): "baseline",
+    ("h264", "Main"): "main",
+    ("h264", "High"): "high",
+    ("h264", "High 10"): "high10",
+    ("h264", "High 4:2:2"): "high422",
+    ("hevc", "Main"): "main",
+    ("hevc", "Main 10"): "main10",
+}
+
+
+def concat_list_entry(filepath):
+    """
+    A `file` line for a concat demuxer list, with the path quoted.
+    """
+    escaped = os.path.abspath(filepath).replace("'", "'\\''")
+    return f"file '{escaped}'\n"
+
+
+def get_stream_parameters(filepath):
+    """
+    Returns the stream parameters that must match for segments to be joined with stream copy.
+
+    Parameters:
+        filepath (str): Path to the video file.
+
+    Returns:
+        dict: Video/audio codec parameters, and the file's start time and duration, or
+            None if the file can't be probed.
+    """
+    try:
+        with span("probe", os.path.basename(filepath)):
+            probe = ffmpeg.probe(filepath)
+        video_stream = next(s for s in probe['streams'] if s['codec_type'] == 'video')
+        audio_stream = next(s for s in probe['streams'] if s['codec_type'] == 'audio')
+    except Exception as e:
+        print(f"Failed to get stream parameters for {filepath}: {e}")
+        return None
+
+    return {
+        "vcodec": video_stream["codec_name"],
+        "profile": video_stream.get("profile"),
+        "pix_fmt": video_stream["pix_fmt"],
+        "width": int(video_stream["width"]),
+        "height": int(video_stream["height"]),
+        "frame_rate": video_stream["r_frame_rate"],
+        "sample_rate": int(audio_stream["sample_rate"]),
+        "channels": int(audio_stream["channels"]),
+        "start_time": float(probe.get("format", {}).get("start_time", 0) or 0),
+        "duration": float(probe.get("format", {}).get("duration", 0) or 0) or None,
+    }
+
+
+def matching_output_options(params, threads=None):
+    """
+    ffmpeg output options that encode video/audio compatible with a source's stream parameters.
+    """
+    if params["vcodec"] not in ENCODERS:
+        raise ValueError(f"Smart render does not support {params['vcodec']} video")
+    encoder, _ = ENCODERS[params["vcodec"]]
+
+    options = {
+        "vcodec": encoder,
+        "pix_fmt": params["pix_fmt"],
+        "r": params["frame_rate"],
+        "acodec": "aac",
+        "ar": params["sample_rate"],
+        "ac": params["channels"],
+    }
+    profile = PROFILES.get((params["vcodec"], params["profile"]))
+    if profile is not None:
+        options["profile:v"] = profile
+    if threads is not None:
+        options["threads"] = threads
+    return options
+
+
+def get_packets(filepath, start_time, end_time, offset=0.0):
+    """
+    (pts_time, is_keyframe) of the first video stream's packets between start_time and end_time.
+
+    Reads packet flags only, so nothing is decoded.
+    """
+    with span("probe", os.path.basename(filepath)):
+        output = subprocess.check_output([
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-read_intervals", f"{start_time + offset}%{end_time + offset}",
+            "-show_entries", "packet=pts_time,flags",
+            "-of", "csv=p=0",
+            filepath
+        ], stderr=subprocess.DEVNULL).decode()
+
+    packets = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if pts_time in ("", "N/A"):
+            continue
+        pts_time = float(pts_time) - offset
+        if start_time <= pts_time <= end_time:
+            packets.append((pts_time, "K" in flags))
+    return sorted(packets)
+
+
+def plan_spans(keyframes, start_time, end_time, fade_duration):
+    """
+    Split a segment into spans to re-encode or stream copy.
+
+    The middle, from the first keyframe after the fade-in to the last keyframe before
+    the fade-out, is copied. The spans before and after it contain the fades and are
+    re-encoded. If there's no such pair of keyframes the whole segment is re-encoded.
+
+    Returns:
+        list of (mode, start, end, fade_in, fade_out) tuples, mode being "encode" or "copy".
+    """
+    copy_start = next((k for k in keyframes if k >= start_time + fade_duration), None)
+    copy_end = next((k for k in reversed(keyframes) if k <= end_time - fade_duration), None)
+    if copy_start is None or copy_end is None or copy_end <= copy_start:
+        return [("encode", start_time, end_time, True, True)]
+
+    spans = []
+    if copy_start > start_time:
+        spans.append(("encode", start_time, copy_start, True, False))
+    spans.append(("copy", copy_start, copy_end, False, False))
+    spans.append(("encode", copy_end, end_time, False, True))
+    return spans
+
+
+def smart_render_segment(input_path, start_time, end_time, output_path, params, fade_duration=0.25, threads=None, encoder_options=None):
+    """
+    Cut a faded segment, re-encoding only the GOPs around the cut points.
+
+    Video is rendered as re-encoded fade spans plus a stream-copied middle, joined
+    with the concat demuxer. Audio is cheap to encode, so it is re-encoded for the
+    whole segment with afade, which also keeps it continuous across the joins.
+
+    The output is MPEG-TS with in-band parameter sets, so segments can be joined by
+    concat_videos with stream copy.
+
+    Parameters:
+        input_path (str): Path to the source video.
+        start_time (float): Segment start, in seconds.
+        end_time (float): Segment end, in seconds.
+        output_path (str): Path to save the segment (.ts).
+        params (dict): Stream parameters of the source, from get_stream_parameters.
+        fade_duration (float): Duration of the fade in/out in seconds.
+        threads (int): Number of encoder threads for ffmpeg.
+        encoder_options (dict): Extra video encoder options for the re-encoded spans, e.g.
+            an encoder profile's preset and CRF.
+    """
+    # Segments are padded and can run past either end of the video
+    start_time = max(start_time, 0)
+    if params.get("duration") is not None:
+        end_time = min(end_time, params["duration"])
+    duration = end_time - start_time
+    options = {**matching_output_options(params, threads), **(encoder_options or {})}
+    _, bitstream_filter = ENCODERS[params["vcodec"]]
+    video_options = {k: v for k, v in options.items() if k not in ("acodec", "ar", "ac")}
+
+    packets = get_packets(input_path, start_time, end_time, offset=params["start_time"])
+    keyframes = [pts_time for pts_time, is_keyframe in packets if is_keyframe]
+    spans = plan_spans(keyframes, start_time, end_time, fade_duration)
+
+    # In the system temp dir like concat_videos' list, so a killed build leaves no spans behind
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        span_paths = []
+        for i, (mode, span_start, span_end, fade_in, fade_out) in enumerate(spans):
+            span_path = os.path.join(tmp_dir, f"span_{i}.ts")
+            source = ffmpeg.input(input_path, ss=span_start, t=span_end - span_start)
+            if mode == "copy":
+                # Stop on a packet count rather than a duration: with B-frames a duration cut
+                # lets frames from the next GOP through. The span is whole closed GOPs, so its
+                # packets in decode order are exactly the frames in [span_start, span_end).
+                frames = sum(1 for pts_time, _ in packets if span_start <= pts_time < span_end)
+                source = ffmpeg.input(input_path, ss=span_start)
+                stream = source.video.output(span_path, vcodec="copy", f="mpegts", **{"bsf:v": bitstream_filter, "frames:v": frames})
+            else:
+                video_stream = source.video
+                if fade_in:
+                    video_stream = video_stream.filter('fade', type='in', start_time=0, duration=fade_duration)
+                if fade_out:
+                    fade_out_start = max(span_end - span_start - fade_duration, 0)
+                    video_stream = video_stream.filter('fade', type='out', start_time=fade_out_start, duration=fade_duration)
+                stream = video_stream.output(span_path, f="mpegts", **video_options)
+            run_ffmpeg(stream, "extract" if mode == "copy" else "fade", span_path)
+            span_paths.append(span_path)
+
+        list_path = os.path.join(tmp_dir, "spans.txt")
+        with open(list_path, "w") as f:
+            for span_path in span_paths:
+                f.write(concat_list_entry(span_path))
+
+        audio = (
+            ffmpeg
+            .input(input_path, ss=start_time, t=duration)
+            .audio
+            .filter('afade', type='in', start_time=0, duration=fade_duration)
+            .filter('afade', type='out', start_time=max(duration - fade_duration, 0), duration=fade_duration)
+        )
+        video = ffmpeg.input(list_path, f="concat", safe=0).video
+        run_ffmpeg(
+            ffmpeg.output(video, audio, output_path, vcodec="copy", acodec="aac", ar=params["sample_rate"], ac=params["channels"], f="mpegts"),
+            "fade", output_path,
+        )
+
+    copied = sum(span_end - span_start for mode, span_start, span_end, _, _ in spans if mode == "copy")
+    print(f"Smart rendered {output_path}: {copied:.1f}s of {duration:.1f}s stream copied")
+    return output_path
+
+
+def concat_videos(video_paths, output_path):
+    """
+    Join videos with the concat demuxer and stream copy. All inputs must share
+    stream parameters, e.g. segments from smart_render_segment.
+
+    Parameters:
+        video_paths (list of str): List of paths to input videos.
+        output_path (str): Path to save the joined video.
+    """
+    if len(video_paths) == 0:
+        raise ValueError("No videos provided for merging.")
+
+    # The list holds absolute paths, so it can live in the system temp dir, never
+    # left next to the output by a build that is killed
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        list_path = os.path.join(tmp_dir, "videos.txt")
+        with open(list_path, "w") as f:
+            for video_path in video_paths:
+                f.write(concat_list_entry(video_path))
+
+        with span("merge", os.path.basename(output_path)):
+            run_ffmpeg(
+                ffmpeg.input(list_path, f="concat", safe=0).output(output_path, c="copy", movflags="+faststart"),
+                "merge", output_path,
+            )
+    print(f"Joined {len(video_paths)} videos into {output_path}")
@@ -1,46 +1,25 @@
 import os
 import cv2
 import numpy as np
-import subprocess
 from pathlib import Path
-from gpmf import GPMFParser
 import scipy.interpolate
 
+from frame_pipeline import FfmpegWriter
+from gpmf_reader import read_stream
+from orientation import estimate_roll
+from render_cache import atomic_output
+from telemetry import Z
+
 INPUT_EXTS = [".mp4", ".lrv"]
 OUTPUT_DIR_NAME = "stable"
 
 
 def extract_gyro(input_path):
-    with open(input_path, "rb") as f:
-        parser = GPMFParser(f.read())
-
-    telemetry = parser.extract_device_data()
-
-    gyro_tracks = [track for track in telemetry if track["FourCC"] == "GYRO"]
-    if not gyro_tracks:
+    # Streams just the GPMF track, rather than reading the whole video into memory
+    gyro = read_stream(input_path, "GYRO")
+    if len(gyro) == 0:
         raise ValueError("No GYRO track found in telemetry")
-
-    gyro_track = gyro_tracks[0]
-    samples = gyro_track["samples"]
-    sample_rate = gyro_track["sample_rate"]
-    if not sample_rate:
-        raise ValueError("No sample rate available for gyro track")
-
-    gyro_data = []
-    for i, sample in enumerate(samples):
-        timestamp = i / sample_rate
-        x, y, z = sample
-        gyro_data.append({"timestamp": timestamp, "x": x, "y": y, "z": z})
-    return gyro_data
-
-
-def integrate_gyro(data, axis):
-    angles = [0]
-    for i in range(1, len(data)):
-        dt = data[i]["timestamp"] - data[i - 1]["timestamp"]
-        omega = data[i][axis]
-        angles.append(angles[-1] + omega * dt)
-    return np.array(angles)
+    return gyro
 
 
 def smooth_angles(angles, window=30):
@@ -48,13 +27,7 @@ def smooth_angles(angles, window=30):
 
 
 def get_rotation_matrix(gyro_data, timestamps, frame_shape, smoothing_window=30):
-    ts = np.array([g["timestamp"] for g in gyro_data])
-    pitch = integrate_gyro(gyro_data, "x")
-    yaw = integrate_gyro(gyro_data, "y")
-    roll = integrate_gyro(gyro_data, "z")
-
-    pitch = smooth_angles(pitch, smoothing_window)
-    yaw = smooth_angles(yaw, smoothing_window)
+    ts, roll = estimate_roll(gyro_data, axis=Z)
     roll = smooth_angles(roll, smoothing_window)
 
     interp_roll = scipy.interpolate.interp1d(
@@ -73,7 +46,7 @@ def get_rotation_matrix(gyro_data, timestamps, frame_shape, smoothing_window=30)
     return transforms
 
 
-def stabilize_video(input_path, output_path, gyro_data):
+def stabilize_video(input_path, output_path, gyro_data, profile=None):
     cap = cv2.VideoCapture(str(input_path))
     fps = cap.get(cv2.CAP_PROP_FPS)
     frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
@@ -89,9 +62,8 @@ def stabilize_video(input_path, output_path, gyro_data):
     transforms = get_rotation_matrix(gyro_data, timestamps, first_frame.shape)
     cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
 
-    temp_path = input_path.with_suffix(".temp.mp4")
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(str(temp_path), fourcc, fps, (width, height))
+    # Encode straight to H.264 with the original audio, no intermediate file
+    out = FfmpegWriter(str(output_path), fps, (width, height), audio_source=str(input_path), profile=profile)
 
     use_cuda = cv2.cuda.getCudaEnabledDeviceCount() > 0
     crop_margin = 30
@@ -120,13 +92,6 @@ def stabilize_video(input_path, output_path, gyro_data):
     cap.release()
     out.release()
 
-    subprocess.run([
-        "ffmpeg", "-y", "-i", str(temp_path),
-        "-vcodec", "libx264", "-crf", "23",
-        str(output_path)
-    ])
-    temp_path.unlink()
-
 
 def main(folder_path):
     folder = Path(folder_path)
@@ -144,7 +109,9 @@ def main(folder_path):
         print(f"Stabilizing {file.name}")
         try:
             gyro = extract_gyro(file)
-            stabilize_video(file, output_file, gyro)
+            # A stabilization that dies midway must not look done on the next run
+            with atomic_output(str(output_file)) as tmp_path:
+                stabilize_video(file, tmp_path, gyro)
         except Exception as e:
             print(f"Failed to stabilize {file.name}: {e}")
 
@@ -1,46 +1,120 @@
+import json
 import os
+import threading
 import numpy as np
 
-from py_gpmf_parser import GoProTelemetryExtractor
-from pydantic import BaseModel
+from gpmf_reader import read_stream
+from instrumentation import span
+from pydantic import BaseModel, ConfigDict
+
+# Column layout of an on-disk telemetry stream: one float64 row per sample.
+TIMESTAMP, X, Y, Z = range(4)
+COLUMNS = ("timestamp", "x", "y", "z")
+
+STREAMS = {
+    "accel": "ACCL",
+    "gyro": "GYRO",
+}
 
 
 class Telemetry(BaseModel):
-    gyro: list
-    accel: list
-    raw_accel_data: list
-    raw_gyro_data: list
-    accel_timestamps: list
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    gyro: np.ndarray
+    accel: np.ndarray
+
+
+def sidecar_path(filepath, stream, ext=".npy"):
+    """
+    Path of the telemetry sidecar for a video, e.g. GX010180.MP4 -> GX010180.accel.npy
+    """
+    base, _ = os.path.splitext(filepath)
+    return f"{base}.{stream}{ext}"
+
+
+def save_stream(filepath, samples: np.ndarray):
+    """
+    Write a telemetry stream as a .npy file, atomically so readers never map a partial file.
+
+    The temporary file is hidden, and unique to the writing process and thread, so
+    concurrent writers (e.g. a request and an ingest worker) never share it.
+    """
+    directory, filename = os.path.split(filepath)
+    tmp_filepath = os.path.join(directory, f".{filename}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_filepath, "wb") as f:
+        np.save(f, np.ascontiguousarray(samples, dtype=np.float64))
+    os.replace(tmp_filepath, filepath)
+
+
+def load_stream(filepath) -> np.ndarray:
+    """
+    Memory-map a telemetry stream written by save_stream. Columns are zero-copy views.
+    """
+    samples = np.load(filepath, mmap_mode="r")
+    if samples.size == 0:
+        return np.empty((0, len(COLUMNS)), dtype=np.float64)
+    return samples
+
+
+def encode_stream(samples: np.ndarray) -> bytes:
+    """
+    Encode telemetry samples as little-endian float32 timestamp/x/y/z rows, for the API.
+    """
+    return np.ascontiguousarray(samples, dtype="<f4").tobytes()
+
+
+def migrate_json_stream(json_filepath, npy_filepath) -> np.ndarray:
+    """
+    Convert a legacy list-of-dict .json sidecar to the columnar .npy format.
+    """
+    with open(json_filepath, "r") as f:
+        content = f.read()
+    datapoints = json.loads(content) if content else []
+    samples = np.array(
+        [[d[column] for column in COLUMNS] for d in datapoints],
+        dtype=np.float64,
+    ).reshape(-1, len(COLUMNS))
+    save_stream(npy_filepath, samples)
+    print(f"Migrated {json_filepath} -> {npy_filepath}")
+    return load_stream(npy_filepath)
 
 
 def get_telemetry(filepath) -> Telemetry:
-    extractor = GoProTelemetryExtractor(filepath)
-    extractor.open_source()
-    [raw_accel_data, accel_timestamps] = extractor.extract_data('ACCL')
-    [raw_gyro_data, gyro_timestamps] = extractor.extract_data('GYRO')
-    extractor.close_source()
-
-    # Convert raw data to a list of dictionaries
-    def convert_to_dict(data, timestamp):
-        return {
-            "timestamp": timestamp,
-            "x": data[0],
-            "y": data[1],
-            "z": data[2],
-        }
-
-    accel = []
-    i = 0
-    for data in raw_accel_data:
-        accel.append(convert_to_dict(data, accel_timestamps[i]))
-        i += 1
-
-    gyro = []
-    i = 0
-    for data in raw_gyro_data:
-        gyro.append(convert_to_dict(data, gyro_timestamps[i]))
-        i += 1
-
-    return Telemetry(accel=accel, gyro=gyro, raw_accel_data=raw_accel_data, raw_gyro_data=raw_gyro_data, accel_timestamps=accel_timestamps)
+    """
+    Extract the accel/gyro streams from a GoPro video. Only the GPMF track is read
+    (see gpmf_reader), so memory use doesn't grow with the size of the video.
+    """
+    with span("telemetry", os.path.basename(filepath), profile=True):
+        streams = {stream: read_stream(filepath, fourcc) for stream, fourcc in STREAMS.items()}
+    return Telemetry(**streams)
+
+
+def load_telemetry(filepath) -> Telemetry:
+    """
+    Load the accel/gyro streams for a video from its .npy sidecars.
+
+    Legacy .json sidecars are migrated on first read, and if neither exists the
+    telemetry is extracted from the video and cached next to it.
+
+    Args:
+        filepath: Path to the MP4 file.
+
+    Returns:
+        Telemetry with memory-mapped (N, 4) timestamp/x/y/z arrays.
+    """
+    streams = {}
+    for stream in STREAMS:
+        npy_filepath = sidecar_path(filepath, stream)
+        json_filepath = sidecar_path(filepath, stream, ext=".json")
+        if os.path.exists(npy_filepath):
+            streams[stream] = load_stream(npy_filepath)
+        elif os.path.exists(json_filepath):
+            streams[stream] = migrate_json_stream(json_filepath, npy_filepath)
 
+    if len(streams) == len(STREAMS):
+        return Telemetry(**streams)
 
+    telemetry = get_telemetry(filepath)
+    for stream in STREAMS:
+        save_stream(sidecar_path(filepath, stream), getattr(telemetry, stream))
+    return Telemetry(**{stream: load_stream(sidecar_path(filepath, stream)) for stream in STREAMS})
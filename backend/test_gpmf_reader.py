@@ -0,0 +1,54 @@
+import struct
+
+import numpy as np
+
+from benchmark import ACCEL_SCALE, GYRO_SCALE, _box, _full_box, mux_gpmf, synthetic_imu
+from gpmf_reader import iter_stream, read_stream
+
+
+def write_mp4(filepath):
+    """
+    A minimal MP4 with an empty moov as its last box, like ffmpeg writes, for mux_gpmf.
+    """
+    mvhd = _full_box(b"mvhd", struct.pack(">IIII", 0, 0, 1000, 0) + b"\0" * 76 + struct.pack(">I", 1))
+    with open(filepath, "wb") as f:
+        f.write(_box(b"ftyp", b"isom\0\0\2\0isom"))
+        f.write(_box(b"moov", mvhd))
+
+
+def quantized(samples, scale):
+    # The muxer stores values as int16 in units of 1/scale
+    return np.column_stack((samples[:, 0], np.round(samples[:, 1:] * scale) / scale))
+
+
+def test_read_stream_round_trip(tmp_path):
+    filepath = str(tmp_path / "GX010001.MP4")
+    accel, gyro = synthetic_imu(duration=5, rate=200)
+    write_mp4(filepath)
+    mux_gpmf(filepath, accel, gyro, duration=5)
+
+    for fourcc, samples, scale in (("ACCL", accel, ACCEL_SCALE), ("GYRO", gyro, GYRO_SCALE)):
+        stream = read_stream(filepath, fourcc)
+        assert stream.shape == samples.shape
+        np.testing.assert_allclose(stream, quantized(samples, scale), atol=1e-9)
+
+
+def test_iter_stream_chunks(tmp_path):
+    filepath = str(tmp_path / "GX010001.MP4")
+    accel, gyro = synthetic_imu(duration=5, rate=200)
+    write_mp4(filepath)
+    mux_gpmf(filepath, accel, gyro, duration=5)
+
+    chunks = list(iter_stream(filepath, "GYRO", payloads_per_chunk=2))
+    # One payload per second, two per chunk
+    assert [len(chunk) for chunk in chunks] == [400, 400, 200]
+    np.testing.assert_array_equal(np.concatenate(chunks), read_stream(filepath, "GYRO"))
+
+
+def test_read_stream_missing_fourcc(tmp_path):
+    filepath = str(tmp_path / "GX010001.MP4")
+    accel, gyro = synthetic_imu(duration=2, rate=200)
+    write_mp4(filepath)
+    mux_gpmf(filepath, accel, gyro, duration=2)
+
+    assert read_stream(filepath, "GPS5").shape == (0, 4)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from benchmark import synthetic_imu
+from interest import INTEREST_SMOOTHING_WINDOW, SUGGESTED_SEGMENT_THRESHOLD, compute_interest, extract_interesting_segments
+
+
+def baseline_segments(accel, gyro, threshold=SUGGESTED_SEGMENT_THRESHOLD, window_size=INTEREST_SMOOTHING_WINDOW,
+                      minimum_length=1, buffer=0.5, merge_distance=3):
+    """
+    The per-sample dict and loop implementation that compute_interest and
+    extract_interesting_segments replaced, as a reference.
+    """
+    data = {}
+    for samples in (accel, gyro):
+        for timestamp, interest in zip(samples[:, 0].tolist(), samples[:, 1:4].sum(axis=1).tolist()):
+            if timestamp not in data:
+                data[timestamp] = interest
+    if not data:
+        return []
+
+    sorted_items = sorted(data.items())
+    timestamps = [t for t, _ in sorted_items]
+    values = np.convolve([v for _, v in sorted_items], np.ones(window_size) / window_size, mode='same')
+    data = dict(zip(timestamps, values))
+
+    segments = []
+    current_start = None
+    for t in timestamps:
+        if data[t] >= threshold:
+            if current_start is None:
+                current_start = t
+        elif current_start is not None:
+            if t - current_start >= minimum_length:
+                segments.append([current_start - buffer, t + buffer])
+            current_start = None
+    if current_start is not None and timestamps[-1] - current_start >= minimum_length:
+        segments.append([current_start - buffer, timestamps[-1] + buffer])
+    if not segments:
+        return []
+
+    merged = [segments[0]]
+    for start, end in segments[1:]:
+        if start - merged[-1][1] <= merge_distance:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(segment) for segment in merged]
+
+
+def vectorized_segments(accel, gyro, **kwargs):
+    timestamps, interest = compute_interest(accel, gyro)
+    return extract_interesting_segments(timestamps, interest, SUGGESTED_SEGMENT_THRESHOLD, **kwargs)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_matches_baseline(seed):
+    accel, gyro = synthetic_imu(duration=120, rate=200, seed=seed)
+    expected = baseline_segments(accel, gyro)
+    assert expected
+    assert vectorized_segments(accel, gyro) == expected
+
+
+def test_matches_baseline_with_merging_and_interest_at_the_end():
+    # Bursts 2s apart get merged, and the last one runs to the end of the data
+    rate = 200
+    t = np.arange(40 * rate) / rate
+    burst = ((t % 8) < 6) | (t > 35)
+    accel = np.column_stack((t, 20 * burst, np.zeros_like(t), np.zeros_like(t)))
+    gyro = np.column_stack((t + 0.5 / rate, np.zeros_like(t), 5 * burst, np.zeros_like(t)))
+    expected = baseline_segments(accel, gyro, merge_distance=3)
+    assert vectorized_segments(accel, gyro, merge_distance=3) == expected
+
+
+def test_empty_streams():
+    empty = np.empty((0, 4))
+    assert baseline_segments(empty, empty) == []
+    assert vectorized_segments(empty, empty) == []
+
+
+def test_stream_shorter_than_window():
+    accel, gyro = synthetic_imu(duration=1, rate=100)
+    # Loud enough for the truncated moving average to cross the threshold
+    accel[:, 1:] += 5000
+    assert len(accel) < INTEREST_SMOOTHING_WINDOW
+    timestamps, interest = compute_interest(accel, gyro)
+    assert len(interest) == len(timestamps)
+    assert vectorized_segments(accel, gyro) == baseline_segments(accel, gyro)
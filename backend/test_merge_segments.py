@@ -0,0 +1,34 @@
+import merge_segments
+from encoder_profiles import get_encoder_profile
+from merge_segments import extract_faded_segment
+from models import Segment, Video
+
+
+def make_video(length):
+    return Video(project_dir_name="P", length=length, size_bytes=0, slug="GX010001", mp4_filename="GX010001.MP4",
+                 lrv_filename=None, thumbnail_filename=None, accel_filename=None, gyro_filename=None,
+                 segments_filename=None)
+
+
+def fade_args(monkeypatch, tmp_path, video, segment):
+    calls = []
+    monkeypatch.setattr(merge_segments, "run_ffmpeg", lambda stream, *args: calls.append(stream))
+    extract_faded_segment(video, segment, str(tmp_path / "segment.mp4"), fade_duration=0.25,
+                          profile=get_encoder_profile("review"))
+    [stream] = calls
+    args = stream.get_args()
+    return float(args[args.index("-ss") + 1]), float(args[args.index("-t") + 1]), " ".join(args)
+
+
+def test_segment_past_the_end_is_clamped(monkeypatch, tmp_path):
+    start_time, duration, args = fade_args(monkeypatch, tmp_path, make_video(10), Segment(start_time=8, end_time=10.5))
+    # Two seconds of video are left, so the fade out ends with them
+    assert (start_time, duration) == (8, 2)
+    assert "fade=duration=0.25:start_time=1.75:type=out" in args
+    assert "afade=duration=0.25:start_time=1.75:type=out" in args
+
+
+def test_segment_before_the_start_is_clamped(monkeypatch, tmp_path):
+    start_time, duration, args = fade_args(monkeypatch, tmp_path, make_video(10), Segment(start_time=-0.5, end_time=3))
+    assert (start_time, duration) == (0, 3)
+    assert "fade=duration=0.25:start_time=2.75:type=out" in args
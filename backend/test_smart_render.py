@@ -0,0 +1,28 @@
+import pytest
+
+import smart_render
+from smart_render import smart_render_segment
+
+PARAMS = {
+    "vcodec": "h264", "profile": "High", "pix_fmt": "yuv420p", "width": 640, "height": 360,
+    "frame_rate": "25/1", "sample_rate": 48000, "channels": 2, "start_time": 0.0, "duration": 10.0,
+}
+
+
+def test_segment_past_the_end_is_clamped(monkeypatch, tmp_path):
+    requested = []
+    streams = []
+    monkeypatch.setattr(smart_render, "get_packets", lambda filepath, start_time, end_time, offset=0.0: requested.append(end_time) or [
+        (t / 25, t % 10 == 0) for t in range(8 * 25, 10 * 25)
+    ])
+    monkeypatch.setattr(smart_render, "run_ffmpeg", lambda stream, *args: streams.append(" ".join(stream.get_args())))
+    smart_render_segment("GX010001.MP4", 8, 10.5, str(tmp_path / "segment.ts"), PARAMS, fade_duration=0.25)
+
+    assert requested == [10]
+    # Fade in, copy from the keyframe at 8.4s to the one at 9.6s, then fade out to the end of the video
+    assert [args.count("-vcodec copy") for args in streams[:-1]] == [0, 1, 0]
+    fade_out = streams[2].split()
+    assert float(fade_out[fade_out.index("-ss") + 1]) + float(fade_out[fade_out.index("-t") + 1]) == pytest.approx(10)
+    assert "afade=duration=0.25:start_time=1.75:type=out" in streams[-1]
+    # The spans were written to the system temp dir
+    assert list(tmp_path.iterdir()) == []
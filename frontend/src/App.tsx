@@ -111,12 +111,15 @@ function ProjectPage() {
     </>
 }
 
+const INTEREST_GRAPH_POINTS = 1000;
+
 function VideoPage() {
     const params = useParams();
     const projectSlug = params.projectSlug;
     const videoSlug = params.videoSlug;
     let [video, setVideo]: [any, any] = React.useState(null);
     let [project, setProject]: [any, any] = React.useState(null);
+    let [interestData, setInterestData]: [any, any] = React.useState([]);
 
     useEffect(() => {
         if (!projectSlug || !videoSlug) {
@@ -125,6 +128,14 @@ function VideoPage() {
         apiClient.getVideo(projectSlug, videoSlug).then(response => {
             setVideo(response.data);
         })
+        // Downsampled server side, so the graph stays small however long the video is
+        apiClient.getInterest(projectSlug, videoSlug, INTEREST_GRAPH_POINTS).then(response => {
+            const series = response.data;
+            setInterestData(series.timestamps.map((timestamp, i) => ({
+                timestamp,
+                interest_level: series.mean[i],
+            })));
+        })
         apiClient.getProject(projectSlug).then(response => {
             const project = response.data;
             project.videos = project.videos.sort((a,b)=> {
@@ -143,7 +154,8 @@ function VideoPage() {
     if (process.env.NODE_ENV === "production") {
         baseURL = window.location.origin;
     }
-    const url = `${baseURL}/static/projects/${video.project_dir_name}/${video.lrv_filename}`;
+    // Served with Range support, so the player only fetches the bytes it plays
+    const url = `${baseURL}/api/project/${projectSlug}/video/${videoSlug}/preview`;
 
     let previousButton = null;
     let nextButton = null;
@@ -164,7 +176,7 @@ function VideoPage() {
             <div className="title">{currentVideoIndex}/{project.videos.length} {video.mp4_filename}</div>
             <div className="nextButton"> {nextButton}</div>
         </div>
-        <VideoWithInterestGraph videoUrl={url} interestData={video.interest_levels} suggestedSegments={video.suggested_segments}  projectSlug={projectSlug} videoSlug={videoSlug} />
+        <VideoWithInterestGraph videoUrl={url} interestData={interestData} suggestedSegments={video.suggested_segments}  projectSlug={projectSlug} videoSlug={videoSlug} />
         </div>
 
 }
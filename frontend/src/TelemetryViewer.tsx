@@ -188,7 +188,7 @@ export const VideoWithInterestGraph: React.FC<Props> = ({
 
     return (
         <div style={{ position: 'relative' }}>
-            <video ref={videoRef} src={videoUrl} controls width="100%" />
+            <video ref={videoRef} src={videoUrl} preload="metadata" controls width="100%" />
             <div style={{ width: '100%', height: 200, position: 'relative' }}>
                 <ResponsiveContainer>
                     <LineChart
@@ -1,8 +1,18 @@
 import {DefaultApi} from "./api-client/api";
 import * as axios from "axios";
 
+// Response of GET /api/project/{project_slug}/video/{video_slug}/interest
+export interface InterestSeries {
+    resolution: number;
+    timestamps: number[];
+    min: number[];
+    max: number[];
+    mean: number[];
+}
+
 class ApiClient {
     _apiClient: DefaultApi | null = null;
+    _axiosClient: axios.AxiosInstance | null = null;
 
     constructor() {
         let baseURL = "http://localhost:8000";
@@ -16,6 +26,7 @@ class ApiClient {
                 "Content-Type": "application/json",
             },
         });
+        this._axiosClient = axiosClient;
         this._apiClient = new DefaultApi(undefined, baseURL, axiosClient);
     }
 
@@ -54,6 +65,16 @@ class ApiClient {
         return this._apiClient.getVideoApiProjectProjectSlugVideoVideoSlugGet(projectSlug, videoSlug);
     }
 
+    getInterest(projectSlug: string, videoSlug: string, points: number, start?: number, end?: number) {
+        if (!this._axiosClient) {
+            throw new Error("API client not initialized");
+        }
+        return this._axiosClient.get<InterestSeries>(
+            `/api/project/${projectSlug}/video/${videoSlug}/interest`,
+            {params: {points, start, end}},
+        );
+    }
+
     buildFinalCut(projectSlug: string) {
         if (!this._apiClient) {
             throw new Error("API client not initialized");